@@ -0,0 +1,48 @@
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+from broadcast import Broadcaster
+from fake_bot_api import FakeBotAPI
+
+
+async def run(args, api):
+    bot = Bot(
+        "123:fake",
+        base_url=api.url,
+        request=HTTPXRequest(connection_pool_size=args.workers),
+    )
+    broadcaster = Broadcaster(bot, workers=args.workers, global_rate=args.rate)
+    slot = datetime.now().replace(microsecond=0)
+    messages = [(chat_id, f"Цитата для {chat_id}") for chat_id in range(args.users)]
+    async with bot:
+        await broadcaster.broadcast(slot, messages)
+    return broadcaster.last_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Рассылка через fake Bot API")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=30)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with FakeBotAPI(latency=args.latency, flood_rate=args.flood_rate) as api:
+        stats = asyncio.run(run(args, api))
+        print(
+            f"users={args.users} workers={args.workers} sent={stats['sent']} "
+            f"failed={stats['failed']} delivered={len(api.sent)} "
+            f"elapsed={stats['elapsed']:.2f}s throughput={stats['throughput']:.1f}/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import database
+from async_db import AsyncDatabase
+from database import Database
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def handle(db, user_id, call, reply_latency):
+    user = await call(db.get_user, user_id)
+    await asyncio.sleep(reply_latency)
+    if user is None:
+        await call(db.add_user, user_id, f"user{user_id}", "09:00")
+    elif random.random() < 0.5:
+        await call(db.update_user_time, user_id, f"{random.randrange(24):02d}:00")
+    else:
+        await call(db.get_random_quote, user_id)
+
+
+async def run(db, call, args):
+    latencies = []
+    lags = []
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    async def update(user_id):
+        arrived = time.perf_counter()
+        await handle(db, user_id, call, args.reply_latency)
+        latencies.append(time.perf_counter() - arrived)
+
+    probe_task = asyncio.create_task(probe())
+    tasks = []
+    interval = 1 / args.rate
+    started = time.perf_counter()
+    for number in range(args.updates):
+        delay = started + number * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(update(random.randrange(args.users))))
+    await asyncio.gather(*tasks)
+    done.set()
+    await probe_task
+    elapsed = time.perf_counter() - started
+    return latencies, lags, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Задержка обработчиков: синхронный sqlite против AsyncDatabase"
+    )
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=3000)
+    parser.add_argument("--rate", type=float, default=500)
+    parser.add_argument("--reply-latency", type=float, default=0.02)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.quotes_filename = os.path.join(directory, "quotes.txt")
+        with open(database.quotes_filename, "w", encoding="utf-8") as file:
+            file.write("Цитата - Автор\n")
+        db = Database(os.path.join(directory, "bench.db"))
+        adb = AsyncDatabase(db)
+
+        async def sync_call(method, *call_args):
+            return method(*call_args)
+
+        async def async_call(method, *call_args):
+            return await getattr(adb, method.__name__)(*call_args)
+
+        for name, call in (("sync", sync_call), ("async", async_call)):
+            latencies, lags, elapsed = asyncio.run(run(db, call, args))
+            print(
+                f"{name:>5}: updates={len(latencies)} {len(latencies) / elapsed:.0f}/s "
+                f"p50={percentile(latencies, 0.5) * 1000:.2f}ms "
+                f"p99={percentile(latencies, 0.99) * 1000:.2f}ms "
+                f"loop_lag_p99={percentile(lags, 0.99) * 1000:.2f}ms "
+                f"loop_lag_mean={statistics.mean(lags) * 1000:.2f}ms"
+            )
+        adb.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import argparse
+import difflib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from database import are_similar, remove_similar_phrases
+from dedup import SimilarityIndex
+
+LETTERS = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+
+
+def make_words(count, rng):
+    return [
+        "".join(rng.choice(LETTERS) for _ in range(rng.randint(2, 10)))
+        for _ in range(count)
+    ]
+
+
+def mutate(line, rng, rate=1 / 30):
+    chars = list(line)
+    for _ in range(rng.randint(1, max(1, int(len(chars) * rate)))):
+        position = rng.randrange(len(chars))
+        action = rng.random()
+        if action < 0.4:
+            chars[position] = rng.choice(LETTERS)
+        elif action < 0.7:
+            del chars[position]
+        else:
+            chars.insert(position, rng.choice(LETTERS + " ,."))
+    return "".join(chars)
+
+
+def restyle(line, rng):
+    # Та же строка в другом регистре или без пунктуации: normalize() их не
+    # различает, а difflib - различает.
+    action = rng.random()
+    if action < 0.3:
+        return line.upper()
+    if action < 0.6:
+        return line.lower()
+    return line.replace(".", "").replace(" - ", " ")
+
+
+def make_corpus(size, duplicates, seed):
+    rng = random.Random(seed)
+    words = make_words(5000, rng)
+    lines = []
+    for _ in range(size):
+        if lines and rng.random() < duplicates:
+            edit = restyle if rng.random() < 0.25 else mutate
+            lines.append(edit(rng.choice(lines), rng))
+        else:
+            quote = " ".join(rng.choice(words) for _ in range(rng.randint(6, 20)))
+            lines.append(f"{quote.capitalize()}. - {rng.choice(words).title()}")
+    return lines
+
+
+def naive_unique(lines, threshold):
+    unique_lines = []
+    for line in lines:
+        line = line.strip()
+        if not any(
+            are_similar(line, unique_line, threshold) for unique_line in unique_lines
+        ):
+            unique_lines.append(line)
+    return unique_lines
+
+
+def indexed_unique(lines, threshold):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "quotes.txt")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        remove_similar_phrases(path, path, threshold)
+        with open(path, "r", encoding="utf-8") as file:
+            return [line.rstrip("\n") for line in file]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def lookup_latency(lines, threshold, seed, probes=1000):
+    # Как при /propose: одна проверка против уже построенного индекса.
+    rng = random.Random(seed)
+    index = SimilarityIndex(threshold)
+    for number, line in enumerate(lines):
+        index.add(number, line)
+    new = make_corpus(probes, 0, seed + 1)
+    duplicates = [mutate(rng.choice(lines), rng) for _ in range(probes)]
+    report = []
+    for name, queries in (("new", new), ("duplicate", duplicates)):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            index.find_similar(query)
+            timings.append(time.perf_counter() - started)
+        report.append(
+            f"{name}: p50={percentile(timings, 0.5) * 1e6:.0f}us "
+            f"p99={percentile(timings, 0.99) * 1e6:.0f}us"
+        )
+    return " ".join(report)
+
+
+def near_threshold_recall(lines, threshold, seed, pairs=2000):
+    # Дубли с сильной правкой: сходство по difflib от порога до порога + 0.1.
+    # Именно такие пары LSH пропускает чаще всего.
+    rng = random.Random(seed)
+    index = SimilarityIndex(threshold)
+    for number, line in enumerate(lines):
+        index.add(number, line)
+    buckets = {}
+    while sum(map(len, buckets.values())) < pairs:
+        original = rng.choice(lines)
+        duplicate = mutate(original, rng, rng.uniform(0.05, 0.2))
+        ratio = difflib.SequenceMatcher(None, duplicate, original).ratio()
+        if threshold <= ratio < threshold + 0.1:
+            bucket = round(threshold + int((ratio - threshold) / 0.025) * 0.025, 3)
+            buckets.setdefault(bucket, []).append(duplicate)
+    report = []
+    for bucket, duplicates in sorted(buckets.items()):
+        found = sum(index.find_similar(line) is not None for line in duplicates)
+        report.append(f"{bucket:.3f}+={found / len(duplicates):.4f}")
+    return " ".join(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение дедупликации цитат")
+    parser.add_argument("--sizes", default="500,2000,10000,50000")
+    parser.add_argument("--naive-limit", type=int, default=2000)
+    parser.add_argument("--duplicates", type=float, default=0.2)
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for size in map(int, args.sizes.split(",")):
+        lines = make_corpus(size, args.duplicates, args.seed)
+
+        started = time.perf_counter()
+        indexed = indexed_unique(lines, args.threshold)
+        indexed_time = time.perf_counter() - started
+        report = f"lines={size} indexed={indexed_time:.2f}s kept={len(indexed)}"
+
+        if size <= args.naive_limit:
+            started = time.perf_counter()
+            naive = naive_unique(lines, args.threshold)
+            naive_time = time.perf_counter() - started
+            missed = len(set(indexed) - set(naive))
+            extra = len(set(naive) - set(indexed))
+            report += (
+                f" naive={naive_time:.2f}s kept={len(naive)}"
+                f" speedup={naive_time / indexed_time:.1f}x missed_duplicates={missed}"
+                f" extra_dropped={extra}"
+            )
+        print(report)
+        print(f"  lookup {lookup_latency(lines, args.threshold, args.seed)}")
+        recall = near_threshold_recall(lines, args.threshold, args.seed)
+        print(f"  recall {recall}")
+
+
+if __name__ == "__main__":
+    main()
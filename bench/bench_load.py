@@ -0,0 +1,384 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import httpx
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import database
+from database import Database, minute_to_time
+from bench_webhook import LAUNCHER, free_port, make_update, percentile, wait_for
+from fake_bot_api import FakeBotAPI
+
+PEAK_MINUTE = 9 * 60
+REPLY_TIMEOUT = 30
+
+# Каждое сообщение сценария ждёт ответа бота, как живой пользователь.
+SCENARIOS = {
+    "start": lambda user_id, rng: ["/start"],
+    "settime": lambda user_id, rng: [
+        "/settime",
+        f"{rng.randrange(24):02d}:{rng.choice((0, 15, 30, 45)):02d}",
+    ],
+    "quote": lambda user_id, rng: ["/quote"],
+    "propose": lambda user_id, rng: [
+        "/propose",
+        f"Мысль {uuid.UUID(int=rng.getrandbits(128)).hex} - Автор {user_id}",
+    ],
+}
+# Рассылку в этом прогоне делает worker.py, бот только отвечает.
+BOT_LAUNCHER = LAUNCHER.replace(
+    "import main",
+    "config.DELIVERY_SHARDS = 1\nconfig.METRICS_PORT = None\nimport main",
+)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"неизвестный сценарий: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def seed(directory, users, quotes, peak, rng):
+    database.quotes_filename = os.path.join(directory, "quotes.txt")
+    with open(database.quotes_filename, "w", encoding="utf-8") as file:
+        file.write("Цитата - Автор\n")
+    db = Database(os.path.join(directory, database.db_name))
+    db.import_quotes(
+        ((f"Цитата номер {i}", f"Автор {i}") for i in range(quotes)), dedup=False
+    )
+    minutes = [
+        PEAK_MINUTE if rng.random() < peak else rng.randrange(24 * 60)
+        for _ in range(users)
+    ]
+    with db.conn:
+        db.conn.executemany(
+            "INSERT INTO users (id, username, time, minute) VALUES (?, ?, ?, ?)",
+            (
+                (user_id, f"user{user_id}", minute_to_time(minute), minute)
+                for user_id, minute in enumerate(minutes, start=1)
+            ),
+        )
+    db.close()
+    return minutes.count(PEAK_MINUTE)
+
+
+def wait_rusage(process, timeout):
+    # os.wait4 отдаёт пиковую память именно этого процесса.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            break
+        time.sleep(0.05)
+    else:
+        process.kill()
+        pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return usage.ru_maxrss / 1024
+
+
+def latency_stats(latencies):
+    if not latencies:
+        return {"p50_ms": 0.0, "p99_ms": 0.0}
+    return {
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def run_broadcast(directory, api, args, peak_users):
+    path = os.path.join(directory, database.db_name)
+    api.sent.clear()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(SRC, "worker.py"),
+            "--db",
+            path,
+            "--api-url",
+            api.url,
+            "--workers",
+            str(args.workers),
+            "--rate",
+            str(args.broadcast_rate),
+            "--run-slot",
+            minute_to_time(PEAK_MINUTE),
+        ],
+        cwd=directory,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    rss = wait_rusage(process, 3600)
+    with sqlite3.connect(path) as conn:
+        fire_at = conn.execute("SELECT MIN(fire_at) FROM delivery_outbox").fetchone()[0]
+        statuses = dict(
+            conn.execute("SELECT status, COUNT(*) FROM delivery_outbox GROUP BY status")
+        )
+    times = sorted(sent_at for sent_at, _, _ in api.sent)
+    chats = Counter(chat_id for _, chat_id, _ in api.sent)
+    elapsed = times[-1] - times[0] if len(times) > 1 else 0
+    return {
+        "users": peak_users,
+        "delivered": len(chats),
+        "missing": peak_users - len(chats),
+        "duplicates": sum(count - 1 for count in chats.values()),
+        # Временные ошибки: worker --run-slot не ждёт повторов и выходит.
+        "retrying": statuses.get("pending", 0),
+        "dead": statuses.get("dead", 0),
+        "throughput": round(len(times) / elapsed, 1) if elapsed else 0.0,
+        # Задержка от начала слота до получения сообщения Bot API.
+        **latency_stats([sent_at - fire_at for sent_at in times] if fire_at else []),
+        "rss_mb": round(rss, 1),
+    }
+
+
+async def drive(api, mode, port, args, rng, users):
+    loop = asyncio.get_running_loop()
+    waiters = {}
+    latencies = defaultdict(list)
+    errors = Counter()
+    update_ids = itertools.count(1)
+    new_ids = itertools.count(users + 1)
+    idle = list(range(1, users + 1))
+    kinds, weights = zip(*args.mix.items())
+
+    def replied(chat_id, at):
+        future = waiters.pop(chat_id, None)
+        if future is not None and not future.done():
+            future.set_result(at)
+
+    api.listeners.append(
+        lambda chat_id: loop.call_soon_threadsafe(replied, chat_id, time.perf_counter())
+    )
+
+    async with httpx.AsyncClient(timeout=REPLY_TIMEOUT) as client:
+
+        async def send(update):
+            if mode == "webhook":
+                await client.post(f"http://127.0.0.1:{port}/telegram", json=update)
+            else:
+                api.push_update(update)
+
+        async def session(kind, user_id, measured):
+            for number, text in enumerate(SCENARIOS[kind](user_id, rng)):
+                if number:
+                    # Человек читает ответ и печатает следующее сообщение.
+                    await asyncio.sleep(args.think)
+                future = waiters[user_id] = loop.create_future()
+                started = time.perf_counter()
+                await send(make_update(next(update_ids), user_id, text))
+                try:
+                    at = await asyncio.wait_for(future, REPLY_TIMEOUT)
+                except asyncio.TimeoutError:
+                    waiters.pop(user_id, None)
+                    errors[kind] += measured
+                    break
+                if measured:
+                    latencies[kind].append(at - started)
+            idle.append(user_id)
+
+        async def run(sessions, measured):
+            tasks = []
+            started = time.perf_counter()
+            for number in range(sessions):
+                delay = started + number / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                kind = rng.choices(kinds, weights)[0]
+                if kind == "start":
+                    user_id = next(new_ids)
+                else:
+                    while not idle:
+                        await asyncio.sleep(0.01)
+                    index = rng.randrange(len(idle))
+                    idle[index], idle[-1] = idle[-1], idle[index]
+                    user_id = idle.pop()
+                tasks.append(asyncio.create_task(session(kind, user_id, measured)))
+            await asyncio.gather(*tasks)
+            return time.perf_counter() - started
+
+        await run(args.warmup, False)
+        elapsed = await run(args.sessions, True)
+
+    report = {
+        kind: {
+            "count": len(latencies[kind]),
+            "errors": errors[kind],
+            **latency_stats(latencies[kind]),
+        }
+        for kind in kinds
+    }
+    everything = [value for values in latencies.values() for value in values]
+    report["total"] = {
+        "count": len(everything),
+        "errors": sum(errors.values()),
+        "throughput": round(len(everything) / elapsed, 1),
+        **latency_stats(everything),
+    }
+    return report
+
+
+def run_handlers(directory, api, args, rng):
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            BOT_LAUNCHER,
+            api.url,
+            args.mode,
+            str(port),
+            str(args.concurrent_updates),
+        ],
+        cwd=directory,
+        env={**os.environ, "PYTHONPATH": SRC},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        ready = "setWebhook" if args.mode == "webhook" else "getUpdates"
+        wait_for(lambda: api.methods[ready], 120)
+        report = asyncio.run(drive(api, args.mode, port, args, rng, args.users))
+    finally:
+        process.terminate()
+        rss = wait_rusage(process, 30)
+    report["total"]["rss_mb"] = round(rss, 1)
+    return report
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+
+def regressions(results, baseline, tolerance):
+    # throughput не должен падать, задержки и память - расти больше чем на
+    # tolerance; ошибок, пропусков и дублей - не больше, чем в базовом прогоне.
+    current = dict(flatten(results["results"]))
+    found = []
+    for key, base in flatten(baseline["results"]):
+        value = current.get(key)
+        name = key.rsplit(".", 1)[-1]
+        if value is None or name in ("count", "users", "delivered"):
+            continue
+        if name == "throughput":
+            bad = value < base * (1 - tolerance)
+        elif name in ("errors", "missing", "duplicates", "retrying", "dead"):
+            bad = value > base
+        else:
+            bad = value > base * (1 + tolerance)
+        if bad:
+            found.append(f"{key}: {base} -> {value}")
+    return found
+
+
+def print_report(results):
+    handlers, broadcast = results["handlers"], results["broadcast"]
+    for kind, stats in handlers.items():
+        line = (
+            f"{kind:>8}: n={stats['count']} errors={stats['errors']} "
+            f"p50={stats['p50_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms"
+        )
+        if kind == "total":
+            line += f" {stats['throughput']:.0f} upd/s rss={stats['rss_mb']:.0f}MB"
+        print(line)
+    print(
+        f"     09:00: users={broadcast['users']} missing={broadcast['missing']} "
+        f"duplicates={broadcast['duplicates']} retrying={broadcast['retrying']} "
+        f"{broadcast['throughput']:.0f} msg/s "
+        f"p50={broadcast['p50_ms']:.0f}ms p99={broadcast['p99_ms']:.0f}ms "
+        f"rss={broadcast['rss_mb']:.0f}MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Нагрузочный прогон: обработчики команд и пик рассылки в 09:00"
+    )
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--quotes", type=int, default=1000)
+    parser.add_argument(
+        "--peak", type=float, default=0.5, help="доля пользователей со временем 09:00"
+    )
+    parser.add_argument(
+        "--mix", type=parse_mix, default="start=1,settime=2,quote=6,propose=1"
+    )
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=100, help="сценариев в секунду")
+    parser.add_argument(
+        "--think", type=float, default=0.2, help="пауза между сообщениями сценария"
+    )
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--concurrent-updates", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument(
+        "--broadcast-rate",
+        type=float,
+        default=1_000_000,
+        help="лимит рассылки, сообщений в секунду (по умолчанию без лимита)",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="записать результаты в JSON")
+    parser.add_argument("--baseline", help="сравнить с сохранённым прогоном")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    params = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("save", "baseline", "tolerance")
+    }
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory, FakeBotAPI(
+        latency=args.latency
+    ) as api:
+        peak_users = seed(directory, args.users, args.quotes, args.peak, rng)
+        broadcast = run_broadcast(directory, api, args, peak_users)
+        handlers = run_handlers(directory, api, args, rng)
+    results = {
+        "params": params,
+        "results": {"handlers": handlers, "broadcast": broadcast},
+    }
+    print_report(results["results"])
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline["params"] != params:
+            print("Параметры прогона отличаются от базового, сравнение невозможно.")
+            sys.exit(2)
+        found = regressions(results, baseline, args.tolerance)
+        for line in found:
+            print(f"Регрессия: {line}")
+        if found:
+            sys.exit(1)
+        print(f"Регрессий нет (допуск {args.tolerance:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
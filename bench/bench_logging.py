@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import database
+import log_config
+from database import Database
+from fake_bot_api import FakeBotAPI
+
+
+def seed(directory, users, quotes):
+    database.quotes_filename = os.path.join(directory, "quotes.txt")
+    with open(database.quotes_filename, "w", encoding="utf-8") as file:
+        file.write("Цитата - Автор\n")
+    db = Database(os.path.join(directory, "bench.db"))
+    db.import_quotes(
+        ((f"Цитата номер {i}", f"Автор {i}") for i in range(quotes)), dedup=False
+    )
+    with db.conn:
+        db.conn.executemany(
+            "INSERT INTO users (id, username, time, minute) VALUES (?, ?, '09:00', 540)",
+            ((user_id, f"user{user_id}") for user_id in range(1, users + 1)),
+        )
+    db.load_schedule()
+    return db
+
+
+def setup_sync(path):
+    # Как было раньше: обработчики прямо на корневом логгере.
+    log_config.stop_logging()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[logging.FileHandler(path), logging.StreamHandler()],
+        force=True,
+    )
+
+
+def setup_queue(path):
+    log_config.setup_logging(path)
+
+
+def measure_handlers(spent):
+    # Время внутри logging по потокам: для очереди это только постановка в неё.
+    for handler in logging.getLogger().handlers:
+        handle = handler.handle
+
+        def timed(record, handle=handle):
+            started = time.perf_counter()
+            try:
+                return handle(record)
+            finally:
+                spent[threading.current_thread().name] += time.perf_counter() - started
+
+        handler.handle = timed
+
+
+async def watch_loop(lags, done):
+    while not done.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lags.append(time.perf_counter() - started - 0.005)
+
+
+async def broadcast(scheduler):
+    lags = []
+    done = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(lags, done))
+    started = time.perf_counter()
+    await scheduler.send_slot(datetime.now(timezone.utc), (None, 540))
+    await scheduler.drain_due()
+    elapsed = time.perf_counter() - started
+    done.set()
+    await watcher
+    return elapsed, sorted(lags)
+
+
+def run(mode, db, scheduler, directory):
+    with db.conn:
+        db.conn.execute("UPDATE users SET last_sent = NULL, active = 1")
+        db.conn.execute("DELETE FROM delivery_outbox")
+    path = os.path.join(directory, f"{mode}.log")
+    (setup_sync if mode == "sync" else setup_queue)(path)
+    spent = defaultdict(float)
+    measure_handlers(spent)
+    elapsed, lags = asyncio.run(broadcast(scheduler))
+    log_config.stop_logging()
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+    with open(path, encoding="utf-8") as file:
+        lines = sum(1 for _ in file)
+    loop = spent.get("MainThread", 0.0)
+    other = sum(spent.values()) - loop
+    print(
+        f"{mode:>5}: slot={elapsed:.2f}s log_lines={lines} "
+        f"logging_on_loop={loop * 1000:.0f}ms logging_in_db_threads={other * 1000:.0f}ms "
+        f"loop_lag_p99={lags[int(len(lags) * 0.99)] * 1000:.1f}ms "
+        f"max={lags[-1] * 1000:.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Логирование во время рассылки: прямо в файл против очереди"
+    )
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--quotes", type=int, default=500)
+    parser.add_argument("--blocked", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        logging.disable(logging.CRITICAL)
+        db = seed(directory, args.users, args.quotes)
+        logging.disable(logging.NOTSET)
+        blocked = range(1, int(args.users * args.blocked) + 1)
+        with FakeBotAPI(blocked=blocked) as api, open(os.devnull, "w") as devnull:
+            import scheduler
+            from broadcast import Broadcaster, create_bot
+
+            scheduler.broadcaster = Broadcaster(
+                create_bot(args.workers, api.url),
+                workers=args.workers,
+                global_rate=1_000_000,
+                per_chat_rate=1_000_000,
+            )
+            stderr, sys.stderr = sys.stderr, devnull
+            try:
+                for mode in ("sync", "queue"):
+                    run(mode, db, scheduler, directory)
+            finally:
+                sys.stderr = stderr
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
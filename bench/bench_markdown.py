@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from quote_files import iter_quotes
+from quote_pool import QuotePool
+from rendering import render_quote
+
+QUOTES_FILE = os.path.join(os.path.dirname(__file__), "..", "quotes.txt")
+
+
+def replace_escape_markdown(data):
+    special_characters = r"_*[]()~`>#!+-.|{}"
+    quote, author = data
+    for char in special_characters:
+        quote = quote.replace(char, f"\\{char}")
+        author = author.replace(char, f"\\{char}")
+    return quote, author
+
+
+def render_with_replace(quote, author):
+    escaped_quote, escaped_author = replace_escape_markdown((quote, author))
+    return f'*"{escaped_quote}"* — _{escaped_author}_'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Скорость подготовки MarkdownV2")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    quotes = list(iter_quotes(QUOTES_FILE))
+    pool = QuotePool()
+    pool.load(
+        (quote_id, quote, author) for quote_id, (quote, author) in enumerate(quotes)
+    )
+    ids = list(range(len(quotes)))
+
+    cases = {
+        "old escape": lambda: [render_with_replace(q, a) for q, a in quotes],
+        "escape": lambda: [render_quote(q, a) for q, a in quotes],
+        "cached": lambda: [pool.rendered(quote_id) for quote_id in ids],
+    }
+    renders = len(quotes) * args.rounds
+    for name, case in cases.items():
+        elapsed = timeit.timeit(case, number=args.rounds)
+        print(f"{name:>12}: {elapsed / renders * 1e6:.3f} мкс на цитату")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SRC = os.path.join(ROOT, "src")
+sys.path.insert(0, SRC)
+
+from fake_bot_api import FakeBotAPI
+
+# Бот запускается как есть, через main.main(), но с конфигом для заглушки.
+LAUNCHER = """
+import sys
+import config
+
+config.TOKEN = "123:fake"
+config.BOT_API_URL = sys.argv[1]
+config.UPDATES_MODE = sys.argv[2]
+config.WEBHOOK_LISTEN = "127.0.0.1"
+config.WEBHOOK_PORT = int(sys.argv[3])
+config.CONCURRENT_UPDATES = int(sys.argv[4])
+import main
+
+main.main()
+"""
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_update(update_id, user_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": "User",
+            "username": f"user{user_id}",
+        },
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(text)}
+        ]
+    return {"update_id": update_id, "message": message}
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        time.sleep(0.05)
+
+
+async def send_updates(api, mode, port, updates, rate, sent_at):
+    url = f"http://127.0.0.1:{port}/telegram"
+    started = time.monotonic()
+    async with httpx.AsyncClient(timeout=30) as client:
+        tasks = []
+        for number, update in enumerate(updates):
+            delay = started + number / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            sent_at[update["message"]["chat"]["id"]].append(time.time())
+            if mode == "webhook":
+                tasks.append(asyncio.create_task(client.post(url, json=update)))
+            else:
+                api.push_update(update)
+        responses = await asyncio.gather(*tasks)
+    return sum(1 for response in responses if response.status_code != 200)
+
+
+def run(mode, args):
+    with tempfile.TemporaryDirectory() as directory, FakeBotAPI(
+        latency=args.latency
+    ) as api:
+        shutil.copy(os.path.join(ROOT, "quotes.txt"), directory)
+        port = free_port()
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                LAUNCHER,
+                api.url,
+                mode,
+                str(port),
+                str(args.concurrent_updates),
+            ],
+            cwd=directory,
+            env={**os.environ, "PYTHONPATH": SRC},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            ready = "setWebhook" if mode == "webhook" else "getUpdates"
+            wait_for(lambda: api.methods[ready], 60)
+
+            users = list(range(1, args.users + 1))
+            starts = [
+                make_update(n, user_id, "/start") for n, user_id in enumerate(users)
+            ]
+            quotes = [
+                make_update(len(users) + n, random.choice(users), "/quote")
+                for n in range(args.updates)
+            ]
+            sent_at = defaultdict(deque)
+            asyncio.run(send_updates(api, mode, port, starts, args.rate, sent_at))
+            wait_for(lambda: len(api.sent) >= len(starts), 120)
+            api.sent.clear()
+            sent_at.clear()
+
+            started = time.time()
+            errors = asyncio.run(
+                send_updates(api, mode, port, quotes, args.rate, sent_at)
+            )
+            wait_for(lambda: len(api.sent) >= len(quotes), 120)
+            elapsed = max(sent for sent, _, _ in api.sent) - started
+            latencies = [
+                sent - sent_at[chat_id].popleft() for sent, chat_id, _ in api.sent
+            ]
+        finally:
+            process.terminate()
+            try:
+                process.wait(15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    print(
+        f"{mode:>7}: updates={len(quotes)} errors={errors} "
+        f"{len(quotes) / elapsed:.0f}/s "
+        f"p50={percentile(latencies, 0.5) * 1000:.1f}ms "
+        f"p99={percentile(latencies, 0.99) * 1000:.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Нагрузка синтетическими обновлениями: webhook против polling"
+    )
+    parser.add_argument(
+        "--mode", choices=["webhook", "polling", "both"], default="both"
+    )
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=200, help="обновлений в секунду")
+    parser.add_argument("--concurrent-updates", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    modes = ["polling", "webhook"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        run(mode, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import database
+from database import Database
+from fake_bot_api import FakeBotAPI
+
+
+def seed(path, users, quotes):
+    database.quotes_filename = os.path.join(os.path.dirname(path), "quotes.txt")
+    with open(database.quotes_filename, "w", encoding="utf-8") as file:
+        file.write("Цитата - Автор\n")
+    db = Database(path)
+    db.import_quotes(
+        ((f"Цитата номер {i}", f"Автор {i}") for i in range(quotes)), dedup=False
+    )
+    with db.conn:
+        db.conn.executemany(
+            "INSERT INTO users (id, username, time, minute) VALUES (?, ?, '09:00', 540)",
+            ((user_id, f"user{user_id}") for user_id in range(1, users + 1)),
+        )
+    return db
+
+
+def run(db, api, path, shards, args):
+    with db.conn:
+        db.conn.execute("UPDATE users SET last_sent = NULL")
+        db.conn.execute("DELETE FROM delivery_leases")
+        db.conn.execute("DELETE FROM delivery_outbox")
+    api.sent.clear()
+    started = time.time()
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(SRC, "worker.py"),
+                "--db",
+                path,
+                "--api-url",
+                api.url,
+                "--shard",
+                str(shard),
+                "--shards",
+                str(shards),
+                "--workers",
+                str(args.workers),
+                "--rate",
+                "1000000",
+                "--run-slot",
+                "09:00",
+            ],
+            cwd=os.path.dirname(path),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        for shard in range(shards)
+    ]
+    for process in processes:
+        process.wait()
+    elapsed = time.time() - started
+    times = [sent_at for sent_at, _, _ in api.sent]
+    chats = [chat_id for _, chat_id, _ in api.sent]
+    send_time = max(times) - min(times) if times else 0
+    print(
+        f"shards={shards} delivered={len(chats)} missing={args.users - len(set(chats))} "
+        f"duplicates={len(chats) - len(set(chats))} "
+        f"wall={elapsed:.2f}s send={send_time:.2f}s "
+        f"throughput={len(chats) / send_time if send_time else 0:.0f}/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Масштабирование рассылки по числу процессов worker.py"
+    )
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--quotes", type=int, default=500)
+    parser.add_argument("--shards", default="1,2,4")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        db = seed(path, args.users, args.quotes)
+        with FakeBotAPI(latency=args.latency) as api:
+            for shards in map(int, args.shards.split(",")):
+                run(db, api, path, shards, args)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
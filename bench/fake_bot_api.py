@@ -0,0 +1,166 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+class Server(ThreadingHTTPServer):
+    # По умолчанию очередь accept - 5 соединений, и под нагрузкой лишние
+    # сбрасываются, а бот видит это как сетевые ошибки.
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class FakeBotAPI:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        flood_rate=0.0,
+        retry_after=1,
+        blocked=(),
+    ):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.blocked = set(blocked)
+        self.sent = []
+        self.calls = 0
+        self.methods = Counter()
+        self.updates = []
+        # Вызываются из потока сервера с chat_id каждого принятого сообщения.
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.updates_ready = threading.Condition(self.lock)
+        self.server = Server((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def push_update(self, update):
+        with self.updates_ready:
+            self.updates.append(update)
+            self.updates_ready.notify_all()
+
+    def get_updates(self, params):
+        offset = int(params.get("offset", 0) or 0)
+        limit = int(params.get("limit", 100) or 100)
+        timeout = min(float(params.get("timeout", 0) or 0), 1)
+        with self.updates_ready:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if not self.updates:
+                self.updates_ready.wait(timeout)
+            return self.updates[:limit]
+
+    def handle(self, method, params):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            self.methods[method] += 1
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self.get_updates(params)}
+        if method.startswith("send") or method.startswith("edit"):
+            chat_id = json.loads(params.get("chat_id", "0"))
+            if random.random() < self.flood_rate:
+                return 429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            if chat_id in self.blocked:
+                return 403, {
+                    "ok": False,
+                    "error_code": 403,
+                    "description": "Forbidden: bot was blocked by the user",
+                }
+            with self.lock:
+                self.sent.append((time.time(), chat_id, params.get("text", "")))
+                message_id = len(self.sent)
+            for listener in self.listeners:
+                listener(chat_id)
+            return 200, {
+                "ok": True,
+                "result": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": params.get("text", ""),
+                },
+            }
+        return 200, {"ok": True, "result": True}
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8")
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = {
+                        key: value if isinstance(value, str) else json.dumps(value)
+                        for key, value in json.loads(body or "{}").items()
+                    }
+                else:
+                    params = {k: v[0] for k, v in parse_qs(body).items()}
+                method = self.path.rsplit("/", 1)[-1]
+                status, payload = api.handle(method, params)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Локальный fake Telegram Bot API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    api = FakeBotAPI(port=args.port, latency=args.latency, flood_rate=args.flood_rate)
+    print(f"Fake Bot API слушает {api.url}")
+    api.server.serve_forever()
@@ -1,11 +1,27 @@
+import asyncio
+import itertools
 import logging
+import os
 import re
-from telegram import Update
+import tempfile
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
-from database import Database
-from config import ADMIN_IDS
+from async_db import AsyncDatabase
+from metrics import instrumented
+from quote_files import QUOTE_FILE_FORMATS, iter_quotes
+from rendering import render_quote
+from config import ADMIN_IDS, ADMIN_DIGEST_SIZE
 
-db = Database()
+db = AsyncDatabase()
+
+LIST_PAGE_ROWS = 40
+LIST_PAGE_CHARS = 3500
+PENDING_PAGE_ROWS = 10
+
+digest_lock = asyncio.Lock()
+digest_turns = itertools.count()
+digest_queued = 0
 
 
 async def check_admin(update: Update, where=None) -> bool:
@@ -17,6 +33,7 @@ async def check_admin(update: Update, where=None) -> bool:
     return user.id in ADMIN_IDS
 
 
+@instrumented
 async def add_quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_admin(update, where="/addquote"):
         return
@@ -43,7 +60,7 @@ async def add_quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        db.add_quote(quote_text, author)
+        await db.add_quote(quote_text, author)
         await update.message.reply_text(f'Цитата добавлена: "{quote_text}" - {author}')
     else:
         await update.message.reply_text(
@@ -51,31 +68,118 @@ async def add_quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+@instrumented
+async def import_quotes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_admin(update, where="/importquotes"):
+        return
+
+    document = update.message.document
+    if document is None:
+        await update.message.reply_text(
+            "Отправь файл .txt, .csv или .jsonl с подписью /importquotes"
+        )
+        return
+
+    extension = os.path.splitext(document.file_name or "")[1].lower()
+    if extension not in QUOTE_FILE_FORMATS:
+        await update.message.reply_text(
+            "Поддерживаются только файлы .txt, .csv и .jsonl"
+        )
+        return
+
+    await update.message.reply_text("Импортирую цитаты...")
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"quotes{extension}")
+            file = await document.get_file()
+            await file.download_to_drive(path)
+            result = await db.import_quotes(iter_quotes(path))
+        report = (
+            f"добавлено {result['added']}, пропущено похожих {result['skipped']}, "
+            f"некорректных строк {result['invalid']}"
+        )
+        if result["error"] is not None:
+            await update.message.reply_text(
+                f"Импорт прерван: {result['error']}. До ошибки {report}."
+            )
+        else:
+            await update.message.reply_text(f"Импорт завершён: {report}.")
+    except Exception as e:
+        logging.error(f"Ошибка при импорте цитат: {e}")
+        await update.message.reply_text(f"Ошибка при импорте цитат: {e}")
+
+
+def quotes_page_lines(rows, backwards=False):
+    lines = []
+    size = 0
+    for quote_id, quote, author in reversed(rows) if backwards else rows:
+        line = f'{quote_id}. "{quote}" — {author}'[:LIST_PAGE_CHARS]
+        if lines and size + len(line) + 1 > LIST_PAGE_CHARS:
+            break
+        lines.append((quote_id, line))
+        size += len(line) + 1
+    return lines[::-1] if backwards else lines
+
+
+async def quotes_page(author, after_id=None, before_id=None):
+    rows = await db.get_quotes_page(after_id, before_id, author, LIST_PAGE_ROWS)
+    lines = quotes_page_lines(rows, backwards=before_id is not None)
+    if not lines:
+        return None, None
+
+    first_id, last_id = lines[0][0], lines[-1][0]
+    buttons = []
+    if await db.has_quotes(before_id=first_id, author=author):
+        buttons.append(
+            InlineKeyboardButton("« Назад", callback_data=f"list_prev_{first_id}")
+        )
+    if await db.has_quotes(after_id=last_id, author=author):
+        buttons.append(
+            InlineKeyboardButton("Вперёд »", callback_data=f"list_next_{last_id}")
+        )
+
+    text = "\n".join(line for _, line in lines)
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+@instrumented
 async def list_quotes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_admin(update, where="/listquotes"):
         return
 
-    quotes = db.get_all_quotes()
-    if not quotes:
+    author = " ".join(context.args) if context.args else None
+    context.user_data["listquotes_author"] = author
+
+    text, reply_markup = await quotes_page(author)
+    if text is None:
         await update.message.reply_text("Нет доступных цитат.")
         return
 
-    response = ""
-    count = 0
+    await update.message.reply_text(text, reply_markup=reply_markup)
 
-    for quote in quotes:
-        response += f'{quote[0]}. "{quote[1]}" — {quote[2]}\n'
-        count += 1
 
-        if count == 40:
-            await update.message.reply_text(response)
-            response = ""
-            count = 0
+@instrumented
+async def list_quotes_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not await check_admin(update, where="/listquotes"):
+        await query.answer()
+        return
+    await query.answer()
+
+    _, direction, quote_id = query.data.split("_")
+    author = context.user_data.get("listquotes_author")
+    if direction == "next":
+        text, reply_markup = await quotes_page(author, after_id=int(quote_id))
+    else:
+        text, reply_markup = await quotes_page(author, before_id=int(quote_id))
 
-    if response:
-        await update.message.reply_text(response)
+    if text is None:
+        await query.edit_message_text("Нет доступных цитат.")
+        return
+    await query.edit_message_text(text, reply_markup=reply_markup)
 
 
+@instrumented
 async def delete_quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_admin(update, where="/deletequote"):
         return
@@ -86,62 +190,321 @@ async def delete_quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         quote_id = int(context.args[0])
-        db.delete_quote(quote_id)
+        await db.delete_quote(quote_id)
         await update.message.reply_text(f"Цитата с номером {quote_id} удалена.")
     except Exception as e:
         await update.message.reply_text(f"Ошибка при удалении цитаты: {e}")
 
 
+async def notify_accepted(context, decided):
+    for _, user_id, quote, author, _ in decided:
+        try:
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=f"Твоя цитата: {render_quote(quote, author)} добавлена\\!",
+                parse_mode="MarkdownV2",
+            )
+        except TelegramError as e:
+            logging.error(f"Не удалось уведомить пользователя {user_id}: {e}")
+
+
+async def decide_quotes(context, accept, first_id, last_id=None):
+    decided = await db.decide_pending_quotes(accept, first_id, last_id)
+    if accept:
+        await notify_accepted(context, decided)
+    return decided
+
+
+@instrumented
 async def handle_quote_decision(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
+    if not await check_admin(update, where="решение по цитате"):
+        return
 
-    data = query.data.split("_")
-    action = data[0]
-    user_id = data[1]
-    quote_id = data[2]
+    action, _, quote_id = query.data.split("_")
+    quote_id = int(quote_id)
 
-    quote, author = db.get_pending_quote(quote_id)
+    quote_text = await db.get_pending_quote(quote_id)
+    decided = await decide_quotes(context, action == "accept", quote_id)
+    if not decided:
+        await query.edit_message_text(
+            text=f"Цитата уже рассмотрена: {quote_text or quote_id}",
+            parse_mode="MarkdownV2" if quote_text else None,
+        )
+        return
 
     if action == "accept":
-        db.add_quote(quote, author)
-
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f'Твоя цитата: *"{quote}"* — _{author}_ добавлена\\!',
+        await query.edit_message_text(
+            text=f"Цитата принята: {quote_text}",
             parse_mode="MarkdownV2",
         )
+    else:
         await query.edit_message_text(
-            text=f'Цитата принята: *"{quote}"* — _{author}_',
+            text=f"Цитата отклонена: {quote_text}",
             parse_mode="MarkdownV2",
         )
 
-    elif action == "reject":
-        db.delete_pending_quote(quote)
 
-        await query.edit_message_text(
-            text=f'Цитата отклонена: *"{quote}"* — _{author}_',
-            parse_mode="MarkdownV2",
+async def pending_page(after_id=0):
+    rows = await db.get_pending_page(after_id, PENDING_PAGE_ROWS)
+    if not rows and after_id:
+        after_id = 0
+        rows = await db.get_pending_page(after_id, PENDING_PAGE_ROWS)
+    if not rows:
+        return None, None
+
+    total = await db.count_pending()
+    lines = [f"На рассмотрении {total} цитат:"]
+    buttons = []
+    for pending_id, user_id, quote, author in rows:
+        lines.append(f'{pending_id}. "{quote}" — {author} (от {user_id})'[:300])
+        buttons.append(
+            [
+                InlineKeyboardButton(
+                    f"✅ {pending_id}",
+                    callback_data=f"pending_accept_{after_id}_{pending_id}",
+                ),
+                InlineKeyboardButton(
+                    f"❌ {pending_id}",
+                    callback_data=f"pending_reject_{after_id}_{pending_id}",
+                ),
+            ]
+        )
+    first_id, last_id = rows[0][0], rows[-1][0]
+    buttons.append(
+        [
+            InlineKeyboardButton(
+                "Принять все",
+                callback_data=f"pending_accept_{after_id}_{first_id}_{last_id}",
+            ),
+            InlineKeyboardButton(
+                "Отклонить все",
+                callback_data=f"pending_reject_{after_id}_{first_id}_{last_id}",
+            ),
+        ]
+    )
+    navigation = []
+    if after_id:
+        navigation.append(
+            InlineKeyboardButton("« В начало", callback_data="pending_page_0")
+        )
+    if len(rows) == PENDING_PAGE_ROWS:
+        navigation.append(
+            InlineKeyboardButton("Вперёд »", callback_data=f"pending_page_{last_id}")
         )
+    if navigation:
+        buttons.append(navigation)
+    return "\n".join(lines), InlineKeyboardMarkup(buttons)
+
 
+def queue_admin_digest(application):
+    # Сводка уходит по расписанию или сразу, когда предложений набралось много.
+    global digest_queued
+    digest_queued += 1
+    if digest_queued >= ADMIN_DIGEST_SIZE:
+        digest_queued = 0
+        application.create_task(send_admin_digest(application.bot))
 
+
+async def send_admin_digest(bot):
+    # Граница уже разосланного хранится в базе, так что после перезапуска
+    # в сводку попадут и предложения, накопившиеся до него.
+    global digest_queued
+    if not ADMIN_IDS:
+        return
+    async with digest_lock:
+        last_id = int(await db.get_setting("admin_digest_last_id", 0))
+        newest_id = await db.last_pending_id()
+        count = await db.count_pending(last_id, newest_id)
+        if not count:
+            return
+        digest_queued = 0
+        text, reply_markup = await pending_page(last_id)
+        if text is None:
+            return
+        text = f"Новых предложений: {count}\n{text}"
+        turn = next(digest_turns)
+        for offset in range(len(ADMIN_IDS)):
+            admin_id = ADMIN_IDS[(turn + offset) % len(ADMIN_IDS)]
+            try:
+                await bot.send_message(admin_id, text, reply_markup=reply_markup)
+                break
+            except TelegramError as e:
+                logging.error(f"Не удалось отправить сводку админу {admin_id}: {e}")
+        else:
+            return
+        await db.set_setting("admin_digest_last_id", newest_id)
+        logging.info(f"Отправил админу {admin_id} сводку из {count} предложений.")
+
+
+@instrumented
+async def list_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_admin(update, where="/pending"):
+        return
+
+    text, reply_markup = await pending_page()
+    if text is None:
+        await update.message.reply_text("Нет цитат на рассмотрении.")
+        return
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+@instrumented
+async def pending_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if not await check_admin(update, where="/pending"):
+        return
+
+    _, action, after_id, *ids = query.data.split("_")
+    if action in ("accept", "reject"):
+        await decide_quotes(context, action == "accept", *map(int, ids))
+
+    text, reply_markup = await pending_page(int(after_id))
+    if text is None:
+        await query.edit_message_text("Нет цитат на рассмотрении.")
+        return
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+async def dead_letters_page(after_id=0):
+    rows = await db.get_dead_deliveries(after_id, PENDING_PAGE_ROWS)
+    if not rows and after_id:
+        after_id = 0
+        rows = await db.get_dead_deliveries(after_id, PENDING_PAGE_ROWS)
+    if not rows:
+        return None, None
+
+    pending = await db.count_deliveries("pending")
+    dead = await db.count_deliveries("dead")
+    lines = [f"В очереди отправки {pending} цитат, не доставлено {dead}:"]
+    for delivery_id, user_id, day, attempts, error in rows:
+        lines.append(
+            f"{delivery_id}. {day} → {user_id}, попыток {attempts}: {error}"[:300]
+        )
+    first_id, last_id = rows[0][0], rows[-1][0]
+    buttons = [
+        [
+            InlineKeyboardButton(
+                "Повторить все",
+                callback_data=f"dead_retry_{after_id}_{first_id}_{last_id}",
+            )
+        ]
+    ]
+    navigation = []
+    if after_id:
+        navigation.append(
+            InlineKeyboardButton("« В начало", callback_data="dead_page_0")
+        )
+    if len(rows) == PENDING_PAGE_ROWS:
+        navigation.append(
+            InlineKeyboardButton("Вперёд »", callback_data=f"dead_page_{last_id}")
+        )
+    if navigation:
+        buttons.append(navigation)
+    return "\n".join(lines), InlineKeyboardMarkup(buttons)
+
+
+@instrumented
+async def list_dead_letters(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_admin(update, where="/deadletters"):
+        return
+
+    text, reply_markup = await dead_letters_page()
+    if text is None:
+        await update.message.reply_text("Недоставленных цитат нет.")
+        return
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+@instrumented
+async def dead_letters_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not await check_admin(update, where="/deadletters"):
+        await query.answer()
+        return
+
+    _, action, after_id, *ids = query.data.split("_")
+    if action == "retry":
+        count = await db.retry_dead_deliveries(*map(int, ids))
+        await query.answer(f"Вернул в очередь {count} цитат.")
+    else:
+        await query.answer()
+
+    text, reply_markup = await dead_letters_page(int(after_id))
+    if text is None:
+        await query.edit_message_text("Недоставленных цитат нет.")
+        return
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+@instrumented
 async def disable_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_admin(update, where="/disable"):
         return
 
-    db.cursor.execute("UPDATE users SET active = 0")
-    db.conn.commit()
+    await db.set_delivery_enabled(False)
     await update.message.reply_text(
         "Бот отключен. Все пользователи не будут получать цитаты."
     )
 
 
+@instrumented
 async def enable_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_admin(update, where="/enable"):
         return
 
-    db.cursor.execute("UPDATE users SET active = 1")
-    db.conn.commit()
+    await db.set_delivery_enabled(True)
     await update.message.reply_text(
         "Бот включен. Все пользователи снова будут получать цитаты."
     )
+
+
+def parse_segment(args):
+    # "09:00" - все, кто получает цитаты в это время; "100-200" - диапазон id.
+    text = "".join(args)
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})", text)
+    if match:
+        hours, minutes = map(int, match.groups())
+        if hours < 24 and minutes < 60:
+            return {"minute": hours * 60 + minutes}
+    match = re.fullmatch(r"(\d+)-(\d+)", text)
+    if match:
+        first_id, last_id = map(int, match.groups())
+        if first_id <= last_id:
+            return {"after_id": first_id - 1, "last_id": last_id}
+    return None
+
+
+async def set_segment_paused(update, context, paused):
+    command = "/pause" if paused else "/resume"
+    if not await check_admin(update, where=command):
+        return
+
+    segment = parse_segment(context.args)
+    if segment is None:
+        await update.message.reply_text(
+            f"Используй: {command} <ЧЧ:ММ> или {command} <id>-<id>"
+        )
+        return
+
+    # Пользователи, ещё не записанные из буфера, тоже должны попасть в выборку.
+    await db.flush_users()
+    # Кусками, чтобы между ними успевали проходить остальные записи в базу.
+    after_id, total = segment.pop("after_id", 0), 0
+    while after_id is not None:
+        after_id, count = await db.pause_users(paused, after_id, **segment)
+        total += count
+    action = "Приостановил" if paused else "Возобновил"
+    await update.message.reply_text(f"{action} рассылку для {total} пользователей.")
+
+
+@instrumented
+async def pause_segment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await set_segment_paused(update, context, True)
+
+
+@instrumented
+async def resume_segment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await set_segment_paused(update, context, False)
@@ -0,0 +1,105 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from cache import MISSING
+from database import Database
+from metrics import DB_SECONDS, DB_ERRORS, DB_INFLIGHT, observe
+
+READERS = 4
+READ_METHODS = {
+    "get_user",
+    "load_user",
+    "get_users_for_slot",
+    "get_setting",
+    "load_delivery_enabled",
+    "get_proposal_limit",
+    "get_conversations",
+    "get_user_data",
+    "get_user_data_ids",
+    "load_user_data",
+    "get_quote",
+    "get_pending_quote",
+    "get_pending_page",
+    "count_pending",
+    "last_pending_id",
+    "count_deliveries",
+    "get_dead_deliveries",
+    "get_quotes_page",
+    "has_quotes",
+}
+BACKGROUND_METHODS = {"insert_quotes", "build_similarity_index"}
+
+
+class AsyncDatabase:
+    _instance = None
+
+    def __new__(cls, db=None, readers=READERS):
+        if cls._instance is None:
+            cls._instance = super(AsyncDatabase, cls).__new__(cls)
+            cls._instance.db = db or Database()
+            cls._instance.writer = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="db-writer"
+            )
+            cls._instance.readers = ThreadPoolExecutor(
+                max_workers=readers, thread_name_prefix="db-reader"
+            )
+        return cls._instance
+
+    def executor_for(self, name):
+        if name in READ_METHODS:
+            return self.readers
+        if name in BACKGROUND_METHODS:
+            return None
+        return self.writer
+
+    async def run(self, executor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        pool = "writer" if executor is self.writer else "readers"
+        if executor is None:
+            pool = "background"
+        DB_INFLIGHT.add(1, pool)
+        try:
+            return await loop.run_in_executor(
+                executor,
+                partial(
+                    observe, DB_SECONDS, DB_ERRORS, func.__name__, func, *args, **kwargs
+                ),
+            )
+        finally:
+            DB_INFLIGHT.add(-1, pool)
+
+    async def get_user(self, user_id):
+        user = self.db.cached_user(user_id)
+        if user is not MISSING:
+            return user
+        return await self.run(self.readers, self.db.load_user, user_id)
+
+    async def import_quotes(self, rows, dedup=True, batch_size=1000):
+        # Запись в базу идёт в фоне, а в quote_pool новые цитаты добавляет поток
+        # записи - как и все остальные его изменения.
+        result, new_quotes = await self.run(
+            None, self.db.insert_quotes, rows, dedup, batch_size
+        )
+        await self.run(self.writer, self.db.remember_quotes, new_quotes)
+        return result
+
+    def find_similar_quote(self, quote):
+        # Поиск идёт в памяти за доли миллисекунды, без похода в пул потоков.
+        return self.db.find_similar_quote(quote)
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+        executor = self.executor_for(name)
+
+        async def call(*args, **kwargs):
+            return await self.run(executor, method, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+    def close(self):
+        self.writer.submit(self.db.close).result()
+        self.writer.shutdown()
+        self.readers.shutdown()
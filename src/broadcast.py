@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from telegram import Bot
+from telegram.error import RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+from config import TOKEN, BOT_API_URL
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат.
+GLOBAL_RATE = 30
+PER_CHAT_RATE = 1
+WORKERS = 16
+MAX_RETRIES = 3
+
+
+def create_bot(workers=WORKERS, base_url=BOT_API_URL):
+    return Bot(
+        TOKEN,
+        base_url=base_url,
+        request=HTTPXRequest(connection_pool_size=workers),
+    )
+
+
+def retry_after_seconds(error):
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        self.refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait_time(self):
+        self.refill()
+        return max(0, (1 - self.tokens) / self.rate)
+
+    def reserve(self):
+        self.refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        self.reserve()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class ChatLimiter:
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_allowed = {}
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        if len(self.next_allowed) > 10000:
+            self.next_allowed = {
+                chat: at for chat, at in self.next_allowed.items() if at > now
+            }
+        at = max(now, self.next_allowed.get(chat_id, now))
+        self.next_allowed[chat_id] = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        bot,
+        workers=WORKERS,
+        global_rate=GLOBAL_RATE,
+        per_chat_rate=PER_CHAT_RATE,
+    ):
+        self.bot = bot
+        self.workers = workers
+        self.global_limiter = TokenBucket(global_rate)
+        self.chat_limiter = ChatLimiter(per_chat_rate)
+        self.last_stats = None
+
+    async def send(self, chat_id, text, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            await self.chat_limiter.acquire(chat_id)
+            await self.global_limiter.acquire()
+            try:
+                return await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except RetryAfter as e:
+                seconds = retry_after_seconds(e)
+                logging.warning(
+                    "Flood control: жду %.0fс перед повтором для %s",
+                    seconds,
+                    chat_id,
+                    extra={"sample": "flood_control", "chat_id": chat_id},
+                )
+                self.global_limiter.pause(seconds)
+                if attempt == MAX_RETRIES:
+                    raise
+
+    async def broadcast(self, slot, messages, stop=None, report=True, **kwargs):
+        queue = asyncio.Queue()
+        for message in messages:
+            queue.put_nowait(message)
+        results = []
+        started = time.monotonic()
+
+        async def worker():
+            while not queue.empty():
+                if stop is not None and stop():
+                    return
+                chat_id, text = queue.get_nowait()
+                try:
+                    await self.send(chat_id, text, **kwargs)
+                    results.append((chat_id, None))
+                except TelegramError as e:
+                    logging.error(
+                        "Не удалось отправить сообщение %s: %s",
+                        chat_id,
+                        e,
+                        extra={"sample": "send_failed", "chat_id": chat_id},
+                    )
+                    results.append((chat_id, e))
+
+        await asyncio.gather(
+            *(worker() for _ in range(min(self.workers, len(messages))))
+        )
+
+        if report:
+            failed = sum(1 for _, error in results if error is not None)
+            self.report(
+                slot,
+                len(results) - failed,
+                failed,
+                time.monotonic() - started,
+                time.time() - slot.timestamp(),
+            )
+        return results
+
+    def report(self, slot, sent, failed, elapsed, lag):
+        self.last_stats = {
+            "slot": slot,
+            "sent": sent,
+            "failed": failed,
+            "elapsed": elapsed,
+            "throughput": (sent + failed) / elapsed if elapsed else 0.0,
+            "lag": lag,
+        }
+        logging.info(
+            f"Слот {slot:%H:%M}: отправлено {sent}, ошибок {failed} "
+            f"за {elapsed:.2f}с ({self.last_stats['throughput']:.1f} сообщ./с), "
+            f"задержка от начала слота {lag:.2f}с"
+        )
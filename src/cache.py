@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del self.data[key]
+                self.misses += 1
+                return MISSING
+            self.data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, generation=None):
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.generation += 1
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.data.clear()
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
@@ -1,2 +1,83 @@
 TOKEN = "YOUR API TOKEN"
 ADMIN_IDS = []  # YOUR ADMIN ID
+
+BOT_API_URL = (
+    "https://api.telegram.org/bot"  # Можно направить на локальный fake Bot API
+)
+
+# "polling" - бот сам забирает обновления через getUpdates;
+# "webhook" - Telegram присылает их POST-запросами на WEBHOOK_URL.
+UPDATES_MODE = "polling"
+WEBHOOK_URL = None  # Публичный https-адрес, например "https://example.com/telegram"
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "telegram"
+WEBHOOK_SECRET = None  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+# Сколько обновлений обрабатывается одновременно (1 - строго по очереди).
+# Обновления одного пользователя всегда идут по очереди, иначе ломаются
+# диалоги /settime и /propose.
+CONCURRENT_UPDATES = 64
+
+# "batched" - изменения пользователей копятся в памяти и пишутся одной транзакцией
+# раз в USER_FLUSH_INTERVAL_MS или после USER_FLUSH_MAX_OPS изменений;
+# "immediate" - каждое изменение сразу фиксируется в базе.
+USER_WRITES = "batched"
+USER_FLUSH_INTERVAL_MS = 200
+USER_FLUSH_MAX_OPS = 500
+
+USER_CACHE_SIZE = 100_000
+USER_CACHE_TTL = 300  # секунд
+
+# Часовой пояс (IANA, например "Europe/Moscow") для пользователей, не выбравших свой;
+# None - часовой пояс сервера.
+DEFAULT_TIMEZONE = None
+
+# Пропущенные отправки (простой, перезапуск) досылаются, если опоздание не больше этого;
+# более старые пропускаются.
+DELIVERY_CATCH_UP = 6 * 60 * 60  # секунд
+
+# Цитаты слота сначала записываются в очередь отправки в базе, а оттуда
+# рассылаются. Временные ошибки повторяются через OUTBOX_RETRY_BASE, 2 * OUTBOX_RETRY_BASE,
+# ... секунд (не больше OUTBOX_RETRY_MAX); после OUTBOX_MAX_ATTEMPTS попыток или
+# DELIVERY_CATCH_UP секунд после начала слота цитата попадает в /deadletters.
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_BASE = 30  # секунд
+OUTBOX_RETRY_MAX = 60 * 60  # секунд
+
+# 0 - цитаты рассылает сам бот; N - рассылкой занимаются N процессов
+# `python worker.py --shard I --shards N` (I от 0 до N-1).
+DELIVERY_SHARDS = 0
+
+# Состояние диалогов (/settime, /propose) и user_data хранятся в базе.
+PERSISTENCE_INTERVAL = 5  # секунд между записями накопленных изменений
+CONVERSATION_TIMEOUT = 15 * 60  # секунд, после которых брошенный диалог забывается
+USER_DATA_MEMORY_MAX = 10_000  # сколько user_data держать в памяти, остальное в базе
+
+# Логи пишутся из отдельного потока. LOG_FORMAT: "text" или "json" (по записи на строку).
+# Файл ротируется по размеру LOG_MAX_BYTES или, если задан LOG_ROTATE_WHEN
+# (например "midnight"), по времени; хранится LOG_BACKUPS старых файлов.
+LOG_FILE = "bot.log"
+LOG_FORMAT = "text"
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_ROTATE_WHEN = None
+LOG_BACKUPS = 5
+# Частые события (каждая отправленная цитата, ошибки отправки) - не больше
+# LOG_SAMPLE_RATE записей в секунду каждого вида, остальные только считаются.
+LOG_SAMPLE_RATE = 20
+
+# Метрики в формате Prometheus на http://METRICS_LISTEN:METRICS_PORT/metrics;
+# None - не открывать. У worker.py порт задаётся параметром --metrics-port.
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 9100
+
+# Новые предложения цитат приходят админам одной сводкой раз в ADMIN_DIGEST_INTERVAL
+# секунд или сразу, как только их накопилось ADMIN_DIGEST_SIZE. Сводки по очереди
+# уходят разным админам из ADMIN_IDS.
+ADMIN_DIGEST_INTERVAL = 5 * 60
+ADMIN_DIGEST_SIZE = 20
+
+# Не больше PROPOSAL_LIMIT предложенных цитат за PROPOSAL_PERIOD секунд на пользователя.
+PROPOSAL_LIMIT = 5
+PROPOSAL_PERIOD = 60 * 60
+# Предложение отклоняется сразу, если похоже на цитату из базы или очереди.
+PROPOSAL_SIMILARITY = 0.85
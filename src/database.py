@@ -1,10 +1,48 @@
 import sqlite3
 import logging
+import re
 import difflib
+import threading
+import time
+from collections import defaultdict
+from dedup import SimilarityIndex, quote_hash
+from migrations import migrate
+from quote_files import iter_quotes
+from quote_pool import QuotePool
+from rendering import render_quote
+from rotation import next_quote
+from user_writes import UserWriteBuffer
+from cache import LRUCache, MISSING
+from config import (
+    USER_WRITES,
+    USER_FLUSH_MAX_OPS,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+    PROPOSAL_SIMILARITY,
+)
 
 quotes_filename = "quotes.txt"
 db_name = "bot_database.db"
 
+PAUSE_CHUNK = 1000
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+BUSY_TIMEOUT = 5
+
+
+def connect(db_name, timeout=BUSY_TIMEOUT, **kwargs):
+    # timeout модуля sqlite3 и есть busy_timeout, отдельная PRAGMA его бы перекрыла.
+    conn = sqlite3.connect(db_name, timeout=timeout, cached_statements=256, **kwargs)
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
 
 def are_similar(str1, str2, threshold=0.9):
     similarity = difflib.SequenceMatcher(None, str1, str2).ratio()
@@ -16,12 +54,12 @@ def remove_similar_phrases(input_file, output_file, threshold=0.9):
         lines = file.readlines()
 
     unique_lines = []
+    index = SimilarityIndex(threshold)
 
     for line in lines:
         line = line.strip()
-        if not any(
-            are_similar(line, unique_line, threshold) for unique_line in unique_lines
-        ):
+        if index.find_similar(line) is None:
+            index.add(len(unique_lines), line)
             unique_lines.append(line)
 
     with open(output_file, "w", encoding="utf-8") as file:
@@ -29,13 +67,13 @@ def remove_similar_phrases(input_file, output_file, threshold=0.9):
             file.write(line + "\n")
 
 
-def escape_markdown(data):
-    special_characters = r"_*[]()~`>#!+-.|{}"
-    quote, author = data
-    for char in special_characters:
-        quote = quote.replace(char, f"\\{char}")
-        author = author.replace(char, f"\\{char}")
-    return quote, author
+def time_to_minute(time):
+    hours, minutes = map(int, time.split(":"))
+    return hours * 60 + minutes
+
+
+def minute_to_time(minute):
+    return f"{minute // 60:02d}:{minute % 60:02d}"
 
 
 class Database:
@@ -44,44 +82,30 @@ class Database:
     def __new__(cls, db_name=db_name):
         if cls._instance is None:
             cls._instance = super(Database, cls).__new__(cls)
-            cls._instance.conn = sqlite3.connect(db_name)
+            cls._instance.db_name = db_name
+            cls._instance.local = threading.local()
+            cls._instance.conn = connect(db_name, check_same_thread=False)
             cls._instance.cursor = cls._instance.conn.cursor()
+            cls._instance.user_writes = UserWriteBuffer()
+            cls._instance.user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+            cls._instance.slot_listeners = []
+            cls._instance.shard = None
+            cls._instance.similar_quotes = SimilarityIndex(PROPOSAL_SIMILARITY)
+            cls._instance.similar_lock = threading.Lock()
+            cls._instance.similar_removed = None
             cls._instance.create_tables()
+            cls._instance.load_delivery_enabled()
+            cls._instance.quote_pool = QuotePool()
             logging.info("Загружаю цитаты...")
             cls._instance.load_initial_quotes()
+            cls._instance.load_quote_pool()
+            cls._instance.load_schedule()
         return cls._instance
 
     def create_tables(self):
         logging.info("Проверяю есть ли таблицы...")
-        self.cursor.execute(
-            """CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            username TEXT,
-            time TEXT,
-            active INTEGER DEFAULT 1
-        )"""
-        )
-
-        self.cursor.execute(
-            """CREATE TABLE IF NOT EXISTS quotes (
-            id INTEGER PRIMARY KEY,
-            quote TEXT,
-            author TEXT
-        )"""
-        )
-
-        self.cursor.execute(
-            """CREATE TABLE IF NOT EXISTS pending_quotes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            quote TEXT NOT NULL,
-            author TEXT NOT NULL,
-            status TEXT NOT NULL DEFAULT 'pending'
-        )"""
-        )
-
-        self.conn.commit()
-        logging.info("Таблицы есть.")
+        version = migrate(self.conn)
+        logging.info(f"Таблицы есть, версия схемы {version}.")
 
     def is_quotes_empty(self):
         self.cursor.execute("SELECT COUNT(*) FROM quotes")
@@ -96,41 +120,274 @@ class Database:
         remove_similar_phrases(quotes_filename, quotes_filename, threshold=0.85)
         logging.info("Убрал повторяющиеся цитаты")
         logging.info("Добавляю цитаты...")
-        try:
-            with open(quotes_filename, "r", encoding="utf-8") as file:
-                for line in file:
-                    if " - " in line:
-                        quote, author = line.rsplit(" - ", 1)
-                        quote = quote.strip().strip('"')
-                        author = author.strip()
-                        self.add_quote(quote, author)
-            logging.info("Цитаты добавлены.")
-        except FileNotFoundError:
+        result = self.import_quotes(iter_quotes(quotes_filename), dedup=False)
+        if isinstance(result["error"], FileNotFoundError):
             logging.error(f"Файл {quotes_filename} не найден.")
-        except Exception as e:
-            logging.error(f"Ошибка при загрузке цитат: {e}")
+        elif result["error"] is not None:
+            logging.error(f"Ошибка при загрузке цитат: {result['error']}")
+        else:
+            logging.info("Цитаты добавлены.")
+
+    def import_quotes(self, rows, dedup=True, batch_size=1000):
+        result, new_quotes = self.insert_quotes(rows, dedup, batch_size)
+        self.remember_quotes(new_quotes)
+        return result
 
-    def add_user(self, user_id, username, time):
+    def insert_quotes(self, rows, dedup=True, batch_size=1000):
+        # Пишет только в базу через своё соединение; quote_pool не трогает,
+        # поэтому может работать в отдельном потоке.
+        result = {"added": 0, "skipped": 0, "invalid": 0, "error": None}
+        conn = connect(self.db_name, timeout=30)
         try:
+            last_id = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM quotes"
+            ).fetchone()[0]
+            # Каждая пачка - отдельная короткая транзакция, а поиск похожих идёт
+            # вне её: бот может писать в базу между пачками. Если импорт оборвался,
+            # уже записанные пачки остаются в базе и попадают в new_quotes.
+            try:
+                self._insert_batches(conn, rows, dedup, batch_size, result)
+            except Exception as e:
+                logging.error(f"Импорт цитат прерван: {e}")
+                result["error"] = e
+            new_quotes = conn.execute(
+                "SELECT id, quote, author FROM quotes WHERE id > ?", (last_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+        logging.info(
+            f"Импортировал {result['added']} цитат, пропустил похожих: "
+            f"{result['skipped']}, некорректных строк: {result['invalid']}."
+        )
+        return result, new_quotes
+
+    def _insert_batches(self, conn, rows, dedup, batch_size, result):
+        index = None
+        if dedup:
+            index = SimilarityIndex(0.85)
+            for quote_id, quote, author in conn.execute(
+                "SELECT id, quote, author FROM quotes"
+            ):
+                index.add(quote_id, f"{quote} - {author}")
+        batch = []
+        for row in rows:
+            if row is None:
+                result["invalid"] += 1
+                continue
+            quote, author = row
+            if index is not None:
+                line = f"{quote} - {author}"
+                if index.find_similar(line) is not None:
+                    result["skipped"] += 1
+                    continue
+                index.add(("new", result["added"] + len(batch)), line)
+            batch.append((quote, author, quote_hash(quote)))
+            if len(batch) >= batch_size:
+                self._insert_batch(conn, batch, result)
+                batch = []
+                if result["added"] % (batch_size * 10) == 0:
+                    logging.info(f"Импортировано {result['added']} цитат...")
+        self._insert_batch(conn, batch, result)
+
+    def _insert_batch(self, conn, batch, result):
+        with conn:
+            conn.executemany(
+                "INSERT INTO quotes (quote, author, quote_hash) VALUES (?, ?, ?)",
+                batch,
+            )
+        result["added"] += len(batch)
+
+    def remember_quotes(self, new_quotes):
+        for quote_id, quote, author in new_quotes:
+            self.quote_pool.add(quote_id, quote, author)
+            self._remember_similar(("quote", quote_id), quote)
+
+    def _shard_filter(self, column="id"):
+        if self.shard is None:
+            return "", ()
+        shard, shards = self.shard
+        return f" AND {column} % ? = ?", (shards, shard)
+
+    def set_shard(self, shard, shards):
+        self.shard = (shard, shards) if shards > 1 else None
+        self.load_schedule()
+
+    def load_schedule(self):
+        schedule = defaultdict(set)
+        user_slots = {}
+        where, params = self._shard_filter()
+        for user_id, tz, minute in self.cursor.execute(
+            "SELECT id, tz, minute FROM users WHERE active = 1 AND minute IS NOT NULL"
+            + where,
+            params,
+        ):
+            schedule[(tz, minute)].add(user_id)
+            user_slots[user_id] = (tz, minute)
+        self.schedule, self.user_slots = schedule, user_slots
+        for slot in schedule:
+            self._slot_added(slot)
+        logging.info(f"Загрузил расписание: {len(self.user_slots)} пользователей.")
+
+    def refresh_slots(self):
+        # Процессу рассылки нужны только непустые слоты, а не каждый пользователь:
+        # DISTINCT идёт по индексу idx_users_slot, без загрузки всех в память.
+        # Отдельные пользователи тут не отслеживаются, поэтому user_slots пуст.
+        where, params = self._shard_filter()
+        slots = set(
             self.cursor.execute(
-                "INSERT INTO users (id, username, time) VALUES (?, ?, ?)",
-                (user_id, username, time),
+                "SELECT DISTINCT tz, minute FROM users "
+                "WHERE active = 1 AND minute IS NOT NULL" + where,
+                params,
             )
-            self.conn.commit()
-            logging.info(f"Добавил пользователя @{username}({user_id}).")
-        except sqlite3.IntegrityError:
-            logging.error(f"Пользователь @{username}({user_id}) уже существует.")
+        )
+        added = slots - self.schedule.keys()
+        self.schedule = defaultdict(
+            set, {slot: self.schedule.get(slot, set()) for slot in slots}
+        )
+        self.user_slots = {}
+        for slot in added:
+            self._slot_added(slot)
+        return len(slots)
+
+    def _slot_added(self, slot):
+        for listener in self.slot_listeners:
+            listener(slot)
+
+    def _schedule_user(self, user_id, slot):
+        if self.shard is not None and user_id % self.shard[1] != self.shard[0]:
+            return
+        self._unschedule_user(user_id)
+        bucket = self.schedule[slot]
+        bucket.add(user_id)
+        self.user_slots[user_id] = slot
+        if len(bucket) == 1:
+            self._slot_added(slot)
+
+    def _unschedule_user(self, user_id):
+        slot = self.user_slots.pop(user_id, None)
+        if slot is not None:
+            bucket = self.schedule[slot]
+            bucket.discard(user_id)
+            if not bucket:
+                del self.schedule[slot]
+
+    def load_quote_pool(self):
+        self.quote_pool.load(
+            self.cursor.execute("SELECT id, quote, author FROM quotes").fetchall()
+        )
+        logging.info(f"Загрузил в память {len(self.quote_pool)} цитат.")
+
+    def reload_quote_pool(self):
+        count, max_id = self.cursor.execute(
+            "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM quotes"
+        ).fetchone()
+        if (count, max_id) == (len(self.quote_pool), self.quote_pool.max_id):
+            return False
+        quote_pool = QuotePool()
+        quote_pool.load(
+            self.cursor.execute("SELECT id, quote, author FROM quotes").fetchall()
+        )
+        old_pool, self.quote_pool = self.quote_pool, quote_pool
+        # Цитаты, добавленные или удалённые другим процессом (import_quotes.py).
+        for quote_id, (quote, _) in quote_pool.quotes.items():
+            if old_pool.get(quote_id) is None:
+                self._remember_similar(("quote", quote_id), quote)
+        for quote_id in old_pool.ids:
+            if quote_pool.get(quote_id) is None:
+                self._forget_similar(("quote", quote_id))
+        logging.info(f"Перезагрузил в память {len(self.quote_pool)} цитат.")
+        return True
+
+    def acquire_lease(self, shard, shards, owner, ttl):
+        now = time.time()
+        with self.conn:
+            conflict = self.conn.execute(
+                "SELECT owner, shards FROM delivery_leases "
+                "WHERE shards != ? AND owner != ? AND expires_at > ?",
+                (shards, owner, now),
+            ).fetchone()
+            if conflict is not None:
+                logging.warning(
+                    f"Рассылку ведёт {conflict[0]} с другим числом шардов "
+                    f"({conflict[1]}), жду освобождения."
+                )
+                return False
+            self.conn.execute(
+                "INSERT INTO delivery_leases (shard, shards, owner, expires_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (shard) DO UPDATE SET "
+                "shards = excluded.shards, owner = excluded.owner, "
+                "expires_at = excluded.expires_at "
+                "WHERE delivery_leases.owner = excluded.owner "
+                "OR delivery_leases.expires_at <= ?",
+                (shard, shards, owner, now + ttl, now),
+            )
+            row = self.conn.execute(
+                "SELECT owner FROM delivery_leases WHERE shard = ?", (shard,)
+            ).fetchone()
+        return row[0] == owner
+
+    def release_lease(self, shard, owner):
+        self.cursor.execute(
+            "DELETE FROM delivery_leases WHERE shard = ? AND owner = ?", (shard, owner)
+        )
+        self.conn.commit()
+
+    def add_user(self, user_id, username, time, tz=None):
+        minute = time_to_minute(time)
+        self.user_writes.add(user_id, username, minute_to_time(minute), minute, tz)
+        self.user_cache.invalidate(user_id)
+        self._schedule_user(user_id, (tz, minute))
+        logging.info(f"Добавил пользователя @{username}({user_id}).")
+        self._user_written()
+
+    def _user_written(self):
+        if USER_WRITES == "immediate" or len(self.user_writes) >= USER_FLUSH_MAX_OPS:
+            self.flush_users()
+
+    def flush_users(self):
+        if not self.user_writes:
+            return 0
+        groups = self.user_writes.grouped()
+        with self.conn:
+            self.conn.executemany("DELETE FROM users WHERE id = ?", groups["delete"])
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO users (id, username, time, minute, tz) "
+                "VALUES (?, ?, ?, ?, ?)",
+                groups["insert"],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO users (id, username, time, minute, tz) "
+                "VALUES (?, ?, ?, ?, ?)",
+                groups["replace"],
+            )
+            self.conn.executemany(
+                "UPDATE users SET time = ?, minute = ? WHERE id = ?", groups["time"]
+            )
+            self.conn.executemany("UPDATE users SET tz = ? WHERE id = ?", groups["tz"])
+        count = len(self.user_writes)
+        for user_id in self.user_writes.ops:
+            self.user_cache.invalidate(user_id)
+        self.user_writes.clear()
+        if USER_WRITES != "immediate":
+            logging.info(
+                "Записал в базу изменения %s пользователей.",
+                count,
+                extra={"sample": "user_flush", "count": count},
+            )
+        return count
 
     def add_quote(self, quote, author):
         try:
             self.cursor.execute(
-                "INSERT INTO quotes (quote, author) VALUES (?, ?)", (quote, author)
+                "INSERT INTO quotes (quote, author, quote_hash) VALUES (?, ?, ?)",
+                (quote, author, quote_hash(quote)),
             )
             self.conn.commit()
+            quote_id = self.cursor.lastrowid
+            self.quote_pool.add(quote_id, quote, author)
+            self._remember_similar(("quote", quote_id), quote)
             logging.info(f'Добавил цитату "{quote}" - {author}')
-            return self.cursor.execute(
-                "SELECT id FROM quotes WHERE quote = ?", (quote,)
-            ).fetchone()
+            return quote_id
         except Exception as e:
             logging.error(f"Ошибка при добавлении цитаты: {e}")
 
@@ -138,19 +395,153 @@ class Database:
         try:
             username = self.get_user(user_id)[1]
             self.cursor.execute(
-                "INSERT INTO pending_quotes (user_id, quote, author) VALUES (?, ?, ?)",
-                (user_id, quote, author),
+                "INSERT INTO pending_quotes (user_id, quote, author, quote_hash) "
+                "VALUES (?, ?, ?, ?)",
+                (user_id, quote, author, quote_hash(quote)),
             )
             self.conn.commit()
+            pending_id = self.cursor.lastrowid
+            self._remember_similar(("pending", pending_id), quote)
             logging.info(
                 f'Пользователь @{username}({user_id}) предложил цитату "{quote}" - {author}'
             )
-            return self.cursor.execute(
-                "SELECT id FROM pending_quotes WHERE quote = ?", (quote,)
-            ).fetchone()[0]
+            return pending_id
         except Exception as e:
             logging.error(f"Ошибка при предложении цитаты: {e}")
 
+    def find_quote(self, quote):
+        for quote_id, existing in self.cursor.execute(
+            "SELECT id, quote FROM quotes WHERE quote_hash = ?", (quote_hash(quote),)
+        ).fetchall():
+            if existing == quote:
+                return quote_id
+        return None
+
+    def decide_pending_quotes(self, accept, first_id, last_id=None):
+        status = "accepted" if accept else "rejected"
+        decided, added = [], []
+        with self.conn:
+            rows = self.conn.execute(
+                "UPDATE pending_quotes SET status = ?, decided_at = ? "
+                "WHERE status = 'pending' AND id BETWEEN ? AND ? "
+                "RETURNING id, user_id, quote, author",
+                (status, time.time(), first_id, last_id or first_id),
+            ).fetchall()
+            for pending_id, user_id, quote, author in sorted(rows):
+                quote_id = None
+                if accept:
+                    quote_id = self.find_quote(quote)
+                    if quote_id is None:
+                        quote_id = self.conn.execute(
+                            "INSERT INTO quotes (quote, author, quote_hash) "
+                            "VALUES (?, ?, ?)",
+                            (quote, author, quote_hash(quote)),
+                        ).lastrowid
+                        added.append((quote_id, quote, author))
+                decided.append((pending_id, user_id, quote, author, quote_id))
+        for quote_id, quote, author in added:
+            self.quote_pool.add(quote_id, quote, author)
+            self._remember_similar(("quote", quote_id), quote)
+        for pending_id, _, quote, author, _ in decided:
+            self._forget_similar(("pending", pending_id))
+            action = "Принял" if accept else "Отклонил"
+            logging.info(
+                f'{action} предложенную цитату {pending_id}: "{quote}" - {author}'
+            )
+        return decided
+
+    def get_pending_page(self, after_id=0, limit=10):
+        return self._read(
+            "SELECT id, user_id, quote, author FROM pending_quotes "
+            "WHERE status = 'pending' AND id > ? ORDER BY id LIMIT ?",
+            (after_id, limit),
+        ).fetchall()
+
+    def count_pending(self, after_id=0, last_id=None):
+        return self._read(
+            "SELECT COUNT(*) FROM pending_quotes "
+            "WHERE status = 'pending' AND id > ? AND id <= COALESCE(?, id)",
+            (after_id, last_id),
+        ).fetchone()[0]
+
+    def last_pending_id(self):
+        return self._read("SELECT COALESCE(MAX(id), 0) FROM pending_quotes").fetchone()[
+            0
+        ]
+
+    def archive_pending_quotes(self, before):
+        decided = "status IN ('accepted', 'rejected') AND decided_at < ?"
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pending_quotes_archive "
+                "SELECT id, user_id, quote, author, status, quote_hash, decided_at "
+                f"FROM pending_quotes WHERE {decided}",
+                (before,),
+            )
+            count = self.conn.execute(
+                f"DELETE FROM pending_quotes WHERE {decided}", (before,)
+            ).rowcount
+        if count:
+            logging.info(f"Перенёс в архив {count} рассмотренных цитат.")
+        return count
+
+    def build_similarity_index(self, chunk_size=50):
+        # Строится в фоне: поиск работает сразу, просто пока видит не все цитаты.
+        started = time.monotonic()
+        with self.similar_lock:
+            self.similar_removed = set()
+        pending = self._read(
+            "SELECT id, quote FROM pending_quotes WHERE status = 'pending'"
+        ).fetchall()
+        items = [
+            (("quote", quote_id), quote)
+            for quote_id, (quote, _) in list(self.quote_pool.quotes.items())
+        ]
+        items += [(("pending", pending_id), quote) for pending_id, quote in pending]
+        for start in range(0, len(items), chunk_size):
+            with self.similar_lock:
+                for key, quote in items[start : start + chunk_size]:
+                    if key not in self.similar_removed:
+                        self.similar_quotes.add(key, quote)
+        with self.similar_lock:
+            self.similar_removed = None
+        logging.info(
+            f"Индекс похожих цитат построен: {len(items)} за "
+            f"{time.monotonic() - started:.1f} с."
+        )
+
+    def _remember_similar(self, key, quote):
+        with self.similar_lock:
+            self.similar_quotes.add(key, quote)
+
+    def _forget_similar(self, key):
+        with self.similar_lock:
+            self.similar_quotes.remove(key)
+            if self.similar_removed is not None:
+                self.similar_removed.add(key)
+
+    def find_similar_quote(self, quote):
+        with self.similar_lock:
+            return self.similar_quotes.find_similar(quote)
+
+    def get_proposal_limit(self, user_id):
+        return self._read(
+            "SELECT tokens, updated_at FROM proposal_limits WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+
+    def save_proposal_limits(self, limits, full):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO proposal_limits (user_id, tokens, updated_at) "
+                "VALUES (?, ?, ?)",
+                limits,
+            )
+            self.conn.executemany(
+                "DELETE FROM proposal_limits WHERE user_id = ?",
+                [(user_id,) for user_id in full],
+            )
+
     def delete_quote(self, quote_id):
         try:
             quote, author = self.cursor.execute(
@@ -158,72 +549,405 @@ class Database:
             ).fetchone()
             self.cursor.execute("DELETE FROM quotes WHERE id = ?", (quote_id,))
             self.conn.commit()
-            logging.info(f'Удалил цитату "{quote}" - {author}')
-        except Exception as e:
-            logging.error(f"Ошибка при удалении цитаты: {e}")
-
-    def delete_pending_quote(self, quote):
-        try:
-            quote, author = self.cursor.execute(
-                "SELECT quote, author FROM pending_quotes WHERE quote = ?", (quote,)
-            ).fetchone()
-            self.cursor.execute("DELETE FROM pending_quotes WHERE id = ?", (quote,))
-            self.conn.commit()
+            self.quote_pool.remove(quote_id)
+            self._forget_similar(("quote", quote_id))
             logging.info(f'Удалил цитату "{quote}" - {author}')
         except Exception as e:
             logging.error(f"Ошибка при удалении цитаты: {e}")
 
     def update_user_time(self, user_id, time):
-        username = self.get_user(user_id)[1]
-        self.cursor.execute("UPDATE users SET time = ? WHERE id = ?", (time, user_id))
-        self.conn.commit()
-        logging.info(f"Пользователь @{username}({user_id}) установил время {time}")
+        minute = time_to_minute(time)
+        time = minute_to_time(minute)
+        user = self.get_user(user_id)
+        self.user_writes.update_time(user_id, time, minute)
+        self.user_cache.invalidate(user_id)
+        if user is not None and user[3]:
+            self._schedule_user(user_id, (user[5], minute))
+        logging.info(f"Пользователь {user_id} установил время {time}")
+        self._user_written()
+
+    def update_user_timezone(self, user_id, tz):
+        user = self.get_user(user_id)
+        self.user_writes.update_timezone(user_id, tz)
+        self.user_cache.invalidate(user_id)
+        if user is not None and user[3] and user[4] is not None:
+            self._schedule_user(user_id, (tz, user[4]))
+        logging.info(f"Пользователь {user_id} установил часовой пояс {tz}")
+        self._user_written()
+
+    def cached_user(self, user_id):
+        pending = self.user_writes.get(user_id)
+        user = MISSING
+        if pending is None or pending[0] == "update":
+            user = self.user_cache.get(user_id)
+        return self.user_writes.overlay(user_id, user)
 
     def get_user(self, user_id):
-        return self.cursor.execute(
-            "SELECT * FROM users WHERE id = ?", (user_id,)
+        user = self.cached_user(user_id)
+        if user is MISSING:
+            user = self.load_user(user_id)
+        return user
+
+    def load_user(self, user_id):
+        generation = self.user_cache.generation
+        user = self._read(
+            "SELECT id, username, time, active, minute, tz FROM users WHERE id = ?",
+            (user_id,),
         ).fetchone()
+        self.user_cache.set(user_id, user, generation)
+        return self.user_writes.overlay(user_id, user)
+
+    def reactivate_user(self, user_id):
+        # Пользователь, которому рассылка отключилась после блокировки бота,
+        # снова написал /start.
+        self.flush_users()
+        self.cursor.execute("UPDATE users SET active = 1 WHERE id = ?", (user_id,))
+        self.conn.commit()
+        self.user_cache.invalidate(user_id)
+        user = self.get_user(user_id)
+        if user is not None and user[4] is not None:
+            self._schedule_user(user_id, (user[5], user[4]))
+        logging.info(f"Пользователь {user_id} снова получает цитаты")
 
     def delete_user(self, user_id):
-        try:
-            username = self.get_user(user_id)[1]
-            self.cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            logging.info(f"Удалил пользователя @{username}({user_id})")
-        except Exception as e:
-            logging.error(f"Ошибка при удалении пользователя: {e}")
-
-    def get_all_users(self):
-        return self.cursor.execute(
-            "SELECT id, username, time FROM users WHERE active = 1"
+        self.user_writes.delete(user_id)
+        self.user_cache.invalidate(user_id)
+        self._unschedule_user(user_id)
+        logging.info(f"Удалил пользователя {user_id}")
+        self._user_written()
+
+    def get_users_for_slot(self, tz, minute, day):
+        if (tz, minute) not in self.schedule:
+            return []
+        where, params = self._shard_filter()
+        return self._read(
+            "SELECT id, username, rotation_seed, rotation_pos, rotation_size "
+            "FROM users WHERE minute = ? AND tz IS ? AND active = 1 AND paused = 0 "
+            "AND last_sent IS NOT ?" + where,
+            (minute, tz, day, *params),
         ).fetchall()
 
+    def load_delivery_enabled(self):
+        self.delivery_enabled = bool(int(self.get_setting("delivery_enabled", 1)))
+        return self.delivery_enabled
+
+    def set_delivery_enabled(self, enabled):
+        self.set_setting("delivery_enabled", int(enabled))
+        self.delivery_enabled = enabled
+
+    def pause_users(
+        self, paused, after_id=0, last_id=None, minute=None, chunk_size=PAUSE_CHUNK
+    ):
+        # Меняет не больше chunk_size пользователей за транзакцию; вызывающий
+        # повторяет с возвращённым id, пока не получит None. Буфер записей
+        # пользователей сбрасывает вызывающий - один раз перед первым куском.
+        where = "id > ? AND id <= COALESCE(?, id) AND (? IS NULL OR minute = ?)"
+        params = (after_id, last_id, minute, minute)
+        with self.conn:
+            row = self.conn.execute(
+                f"SELECT MAX(id) FROM (SELECT id FROM users WHERE {where} "
+                "ORDER BY id LIMIT ?)",
+                (*params, chunk_size),
+            ).fetchone()
+            if row[0] is None:
+                return None, 0
+            count = self.conn.execute(
+                f"UPDATE users SET paused = ? WHERE {where} AND id <= ? "
+                "AND paused != ?",
+                (int(paused), *params, row[0], int(paused)),
+            ).rowcount
+        return row[0], count
+
     def get_quote(self, quote_id):
-        quote, author = self.cursor.execute(
-            "SELECT quote, author FROM quotes WHERE id = ?", (quote_id,)
-        ).fetchone()
-        escaped_quote, escaped_author = escape_markdown((quote, author))
-        return escaped_quote, escaped_author
+        return self.quote_pool.rendered(quote_id)
 
     def get_pending_quote(self, quote_id):
-        quote, author = self.cursor.execute(
+        row = self._read(
             "SELECT quote, author FROM pending_quotes WHERE id = ?", (quote_id,)
         ).fetchone()
-        escaped_quote, escaped_author = escape_markdown((quote, author))
-        return escaped_quote, escaped_author
+        return None if row is None else render_quote(*row)
 
     def get_random_quote(self, user_id):
-        username = self.get_user(user_id)[1]
-        quote, author = self.cursor.execute(
-            "SELECT quote, author FROM quotes ORDER BY RANDOM() LIMIT 1"
+        if user_id in self.user_writes:
+            self.flush_users()
+        username, seed, position, size = self.cursor.execute(
+            "SELECT username, rotation_seed, rotation_pos, rotation_size "
+            "FROM users WHERE id = ?",
+            (user_id,),
         ).fetchone()
-        logging.info(
-            f'Отправил цитату "{quote}" - {author} пользователю @{username}({user_id})'
+        quotes = self.get_quotes_for_users([(user_id, username, seed, position, size)])
+        return quotes.get(user_id)
+
+    def get_quotes_for_users(self, users, day=None, commit=True):
+        quotes = {}
+        rotations = []
+        for user_id, username, seed, position, size in users:
+            quote_id, seed, position, size = next_quote(
+                self.quote_pool, seed, position, size
+            )
+            if quote_id is None:
+                continue
+            rotations.append((seed, position, size, day, user_id))
+            quote, author = self.quote_pool.get(quote_id)
+            # Строка собирается, только если запись прошла выборку.
+            logging.info(
+                'Отправил цитату "%s" - %s пользователю @%s(%s)',
+                quote,
+                author,
+                username,
+                user_id,
+                extra={
+                    "sample": "quote_sent",
+                    "user_id": user_id,
+                    "quote_id": quote_id,
+                },
+            )
+            quotes[user_id] = self.quote_pool.rendered(quote_id)
+        self.cursor.executemany(
+            "UPDATE users SET rotation_seed = ?, rotation_pos = ?, rotation_size = ?, "
+            "last_sent = COALESCE(?, last_sent) WHERE id = ?",
+            rotations,
+        )
+        if commit:
+            self.conn.commit()
+        return quotes
+
+    def enqueue_deliveries(self, users, day, fire_at):
+        # Ротация, last_sent и очередь отправки меняются одной транзакцией:
+        # после падения цитата либо уже в очереди, либо слот разошлётся заново.
+        now = time.time()
+        with self.conn:
+            quotes = self.get_quotes_for_users(users, day, commit=False)
+            return self.cursor.executemany(
+                "INSERT OR IGNORE INTO delivery_outbox "
+                "(user_id, day, text, fire_at, next_attempt_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (user_id, day, text, fire_at, now, now)
+                    for user_id, text in quotes.items()
+                ),
+            ).rowcount
+
+    def claim_deliveries(self, limit, lease):
+        # Взятые цитаты откладываются на lease секунд: если процесс упадёт
+        # посреди пачки, они сами вернутся в очередь.
+        now = time.time()
+        where, params = self._shard_filter("user_id")
+        with self.conn:
+            return self.conn.execute(
+                "UPDATE delivery_outbox SET next_attempt_at = ? WHERE id IN ("
+                "SELECT id FROM delivery_outbox WHERE status = 'pending' "
+                "AND next_attempt_at <= ? AND EXISTS (SELECT 1 FROM users "
+                "WHERE users.id = delivery_outbox.user_id AND active = 1 AND paused = 0)"
+                + where
+                + " ORDER BY next_attempt_at LIMIT ?) "
+                "RETURNING id, user_id, text, attempts, fire_at",
+                (now + lease, now, *params, limit),
+            ).fetchall()
+
+    def finish_deliveries(self, sent, retry, dead, gone, released):
+        now = time.time()
+        if gone:
+            self.flush_users()
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE delivery_outbox SET status = 'sent', attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?",
+                ((now, delivery_id) for delivery_id in sent),
+            )
+            self.conn.executemany(
+                "UPDATE delivery_outbox SET attempts = attempts + 1, "
+                "next_attempt_at = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                ((at, error, now, delivery_id) for at, error, delivery_id in retry),
+            )
+            self.conn.executemany(
+                "UPDATE delivery_outbox SET status = 'dead', attempts = attempts + 1, "
+                "last_error = ?, updated_at = ? WHERE id = ?",
+                ((error, now, delivery_id) for error, delivery_id in dead),
+            )
+            self.conn.executemany(
+                "UPDATE delivery_outbox SET next_attempt_at = ? WHERE id = ?",
+                ((now, delivery_id) for delivery_id in released),
+            )
+            self.conn.executemany(
+                "UPDATE users SET active = 0 WHERE id = ?",
+                ((user_id,) for user_id in gone),
+            )
+        for user_id in gone:
+            self.user_cache.invalidate(user_id)
+            self._unschedule_user(user_id)
+        if gone:
+            logging.info(
+                f"Отключил рассылку {len(gone)} пользователям, недоступным в Telegram."
+            )
+
+    def expire_deliveries(self, before):
+        # Как и пропущенные слоты, цитаты старше DELIVERY_CATCH_UP уже не досылаются.
+        where, params = self._shard_filter("user_id")
+        with self.conn:
+            return self.conn.execute(
+                "UPDATE delivery_outbox SET status = 'dead', last_error = 'expired', "
+                "updated_at = ? WHERE status = 'pending' AND fire_at < ?" + where,
+                (time.time(), before, *params),
+            ).rowcount
+
+    def prune_deliveries(self, sent_before, dead_before):
+        with self.conn:
+            count = self.conn.execute(
+                "DELETE FROM delivery_outbox WHERE (status = 'sent' AND updated_at < ?) "
+                "OR (status = 'dead' AND updated_at < ?)",
+                (sent_before, dead_before),
+            ).rowcount
+        if count:
+            logging.info(f"Удалил из очереди отправки {count} старых записей.")
+        return count
+
+    def count_deliveries(self, status):
+        where, params = self._shard_filter("user_id")
+        return self._read(
+            "SELECT COUNT(*) FROM delivery_outbox WHERE status = ?" + where,
+            (status, *params),
+        ).fetchone()[0]
+
+    def get_dead_deliveries(self, after_id=0, limit=10):
+        return self._read(
+            "SELECT id, user_id, day, attempts, last_error FROM delivery_outbox "
+            "WHERE status = 'dead' AND id > ? ORDER BY id LIMIT ?",
+            (after_id, limit),
+        ).fetchall()
+
+    def retry_dead_deliveries(self, first_id, last_id=None):
+        # Повтор - как новая цитата: счётчик попыток и срок доставки заново.
+        now = time.time()
+        with self.conn:
+            count = self.conn.execute(
+                "UPDATE delivery_outbox SET status = 'pending', attempts = 0, "
+                "fire_at = ?, next_attempt_at = ?, last_error = NULL, updated_at = ? "
+                "WHERE status = 'dead' AND id BETWEEN ? AND ? AND user_id IN "
+                "(SELECT id FROM users WHERE active = 1)",
+                (now, now, now, first_id, last_id or first_id),
+            ).rowcount
+        logging.info(f"Вернул в очередь отправки {count} недоставленных цитат.")
+        return count
+
+    def get_setting(self, key, default=None):
+        row = self._read("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_setting(self, key, value):
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value)
+        )
+        self.conn.commit()
+
+    def get_conversations(self, name, since):
+        return self._read(
+            "SELECT key, state FROM conversations WHERE name = ? AND updated_at >= ?",
+            (name, since),
+        ).fetchall()
+
+    def get_user_data(self, limit):
+        return self._read(
+            "SELECT user_id, data FROM user_data ORDER BY updated_at DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+    def get_user_data_ids(self, offset):
+        return [
+            row[0]
+            for row in self._read(
+                "SELECT user_id FROM user_data ORDER BY updated_at DESC "
+                "LIMIT -1 OFFSET ?",
+                (offset,),
+            )
+        ]
+
+    def load_user_data(self, user_id):
+        row = self._read(
+            "SELECT data FROM user_data WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def save_persistence(self, conversations, user_data):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                [
+                    (name, key)
+                    for (name, key), state in conversations.items()
+                    if state is None
+                ],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO conversations (name, key, state, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (name, key, state, now)
+                    for (name, key), state in conversations.items()
+                    if state is not None
+                ],
+            )
+            self.conn.executemany(
+                "DELETE FROM user_data WHERE user_id = ?",
+                [(user_id,) for user_id, data in user_data.items() if data is None],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO user_data (user_id, data, updated_at) "
+                "VALUES (?, ?, ?)",
+                [
+                    (user_id, data, now)
+                    for user_id, data in user_data.items()
+                    if data is not None
+                ],
+            )
+
+    def expire_conversations(self, before):
+        count = self.cursor.execute(
+            "DELETE FROM conversations WHERE updated_at < ?", (before,)
+        ).rowcount
+        self.conn.commit()
+        if count:
+            logging.info(f"Удалил {count} брошенных диалогов.")
+        return count
+
+    def _quotes_filter(self, after_id, before_id, author):
+        conditions, params = [], []
+        if after_id is not None:
+            conditions.append("id > ?")
+            params.append(after_id)
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        if author:
+            # % и _ в тексте фильтра - обычные символы, а не шаблон LIKE.
+            author = re.sub(r"([\\%_])", r"\\\1", author)
+            conditions.append("author LIKE ? ESCAPE '\\'")
+            params.append(f"%{author}%")
+        return " AND ".join(conditions) or "1", params
+
+    def get_quotes_page(self, after_id=None, before_id=None, author=None, limit=40):
+        where, params = self._quotes_filter(after_id, before_id, author)
+        order = "DESC" if before_id is not None else "ASC"
+        rows = self._read(
+            f"SELECT id, quote, author FROM quotes WHERE {where} "
+            f"ORDER BY id {order} LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        return rows[::-1] if before_id is not None else rows
+
+    def has_quotes(self, after_id=None, before_id=None, author=None):
+        where, params = self._quotes_filter(after_id, before_id, author)
+        return (
+            self._read(f"SELECT 1 FROM quotes WHERE {where} LIMIT 1", params).fetchone()
+            is not None
         )
-        escaped_quote, escaped_author = escape_markdown((quote, author))
-        return escaped_quote, escaped_author
 
-    def get_all_quotes(self):
-        return self.cursor.execute("SELECT id, quote, author FROM quotes").fetchall()
+    def _read(self, query, params=()):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = connect(self.db_name)
+        return conn.execute(query, params)
 
     def close(self):
         self.conn.close()
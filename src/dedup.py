@@ -0,0 +1,119 @@
+import difflib
+import hashlib
+import operator
+import re
+from collections import Counter, defaultdict
+
+# Подобрано по bench/bench_dedup.py (recall): при сходстве 0.85-0.95 по difflib
+# доля общих шинглов опускается до 0.4, и с 16 полосами по 4 символа терялось
+# ~1% таких дублей. Тройки символов и 24 полосы находят их все, индекс строится
+# примерно вдвое дольше.
+SHINGLE_SIZE = 3
+BANDS = 24
+ROWS = 2
+BINS = BANDS * ROWS
+MIN_MATCHING_BINS = 8
+MASK64 = (1 << 64) - 1
+
+
+def normalize(text):
+    return " ".join(re.sub(r"[\W_]+", " ", text.lower()).split())
+
+
+def shingles(text):
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i : i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(text):
+    # One permutation hashing: одна хеш-функция, минимум в каждой из BINS корзин.
+    bins = [-1] * BINS
+    for value in map(hash, shingles(text)):
+        value, index = divmod(value & MASK64, BINS)
+        if bins[index] < 0 or value < bins[index]:
+            bins[index] = value
+    # Пустые корзины заполняем из ближайшей непустой справа (densified OPH),
+    # иначе короткие строки совпадали бы по пустым корзинам.
+    if -1 in bins and bins.count(-1) < BINS:
+        nearest = next(i for i, value in enumerate(bins) if value >= 0) + BINS
+        for index in range(BINS - 1, -1, -1):
+            if bins[index] >= 0:
+                nearest = index
+            else:
+                bins[index] = bins[nearest % BINS] + nearest - index
+    return bins
+
+
+def bands(bins):
+    return [
+        (band, tuple(bins[band * ROWS : (band + 1) * ROWS])) for band in range(BANDS)
+    ]
+
+
+class SimilarityIndex:
+    def __init__(self, threshold=0.85):
+        self.threshold = threshold
+        self.texts = {}
+        self.signatures = {}
+        self.buckets = defaultdict(set)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, key, text):
+        self.remove(key)
+        self.texts[key] = text
+        self.signatures[key] = signature(normalize(text))
+        for band in bands(self.signatures[key]):
+            self.buckets[band].add(key)
+
+    def remove(self, key):
+        text = self.texts.pop(key, None)
+        if text is None:
+            return
+        for band in bands(self.signatures.pop(key)):
+            bucket = self.buckets[band]
+            bucket.discard(key)
+            if not bucket:
+                del self.buckets[band]
+
+    def candidates(self, normalized):
+        bins = signature(normalized)
+        keys = set()
+        for band in bands(bins):
+            keys.update(self.buckets.get(band, ()))
+        matching = [
+            (sum(map(operator.eq, bins, self.signatures[key])), key) for key in keys
+        ]
+        # Сначала самые похожие: настоящий дубль проверяется первым.
+        matching.sort(key=operator.itemgetter(0), reverse=True)
+        return [key for count, key in matching if count >= MIN_MATCHING_BINS]
+
+    def find_similar(self, text):
+        # Совпадение после normalize - ещё не дубль: строки, отличающиеся
+        # регистром или пунктуацией, проходят ту же проверку difflib, что и
+        # остальные кандидаты (у них все корзины совпадают, они идут первыми).
+        normalized = normalize(text)
+        matcher = difflib.SequenceMatcher(None, text)
+        counts = None
+        for key in self.candidates(normalized):
+            other = self.texts[key]
+            total = len(text) + len(other)
+            if 2 * min(len(text), len(other)) < self.threshold * total:
+                continue
+            # То же, что matcher.quick_ratio(), но без пересчёта словаря для seq2.
+            if counts is None:
+                counts = Counter(text)
+            common = sum((counts & Counter(other)).values())
+            if 2 * common < self.threshold * total:
+                continue
+            matcher.set_seq2(other)
+            if matcher.ratio() >= self.threshold:
+                return key
+        return None
+
+
+def quote_hash(text):
+    digest = hashlib.blake2b(normalize(text).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
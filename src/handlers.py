@@ -1,18 +1,18 @@
+import math
 import re
-from telegram import (
-    Update,
-    ReplyKeyboardMarkup,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
-)
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from admin import check_admin, ADMIN_IDS
-from database import Database, escape_markdown
+from admin import check_admin, queue_admin_digest
+from async_db import AsyncDatabase
+from metrics import instrumented
+from throttle import proposal_limiter
 
-db = Database()
+db = AsyncDatabase()
 AWAIT_TIME, AWAIT_QUOTE = 1, 1
 
 
+@instrumented
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     if text.lower() == "начать":
@@ -23,12 +23,15 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await cancel(update, context)
 
 
+@instrumented
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
-    existing_user = db.get_user(user.id)
+    # Мимо кэша: рассылку могли отключить в процессе worker.py, и кэш этого
+    # процесса ещё считает пользователя активным.
+    existing_user = await db.load_user(user.id)
     if existing_user is None:
-        db.add_user(user.id, user.username, "09:00")
+        await db.add_user(user.id, user.username, "09:00")
         await update.message.reply_text(
             "Привет! Я - бот, который по расписанию будет присылать тебе цитаты, в основном мотивирующие.\n\n"
             "Время для отправки по умолчанию - 09:00. Ты можешь настроить время отправки цитат с помощью кнопки снизу. "
@@ -40,6 +43,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 resize_keyboard=True,
             ),
         )
+    elif not existing_user[3]:
+        # Рассылка отключилась, когда бот был заблокирован; раз пишет - вернулся.
+        await db.reactivate_user(user.id)
+        await update.message.reply_text(
+            f"С возвращением! Снова буду присылать цитаты в {existing_user[2]}.",
+            reply_markup=ReplyKeyboardMarkup(
+                [["Установить время", "Случайная цитата"], ["Предложить цитату"]],
+                one_time_keyboard=True,
+                resize_keyboard=True,
+            ),
+        )
     else:
         await update.message.reply_text(
             f"Привет! Мы с тобой уже знакомы. Твоё текущее время для отправки цитат: {existing_user[2]}.\n\n"
@@ -52,12 +66,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+@instrumented
 async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
-    existing_user = db.get_user(user.id)
+    existing_user = await db.get_user(user.id)
     if existing_user:
-        db.delete_user(user.id)
+        await db.delete_user(user.id)
         await update.message.reply_text(
             "Я удалил все твои данные, теперь можем начать заново!\n\n"
             "Для этого напиши /start или нажми кнопку ниже.",
@@ -69,10 +84,11 @@ async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+@instrumented
 async def set_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
-    existing_user = db.get_user(user.id)
+    existing_user = await db.get_user(user.id)
     if existing_user:
         await update.message.reply_text(
             "Пожалуйста, укажи время в формате ЧЧ:ММ.",
@@ -85,10 +101,11 @@ async def set_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return AWAIT_TIME
 
 
+@instrumented
 async def receive_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
-    existing_user = db.get_user(user.id)
+    existing_user = await db.get_user(user.id)
     if existing_user:
         time = update.message.text
 
@@ -105,7 +122,7 @@ async def receive_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return AWAIT_TIME
 
-        db.update_user_time(user.id, time)
+        await db.update_user_time(user.id, time)
         await update.message.reply_text(
             f"Время для получения цитат обновлено на {time}.",
             reply_markup=ReplyKeyboardMarkup(
@@ -117,10 +134,38 @@ async def receive_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
 
+@instrumented
+async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    existing_user = await db.get_user(user.id)
+    if existing_user:
+        if not context.args:
+            await update.message.reply_text(
+                f"Твой часовой пояс: {existing_user[5] or 'по умолчанию (как у сервера)'}.\n\n"
+                "Чтобы изменить его, напиши /timezone <пояс>, например /timezone Europe/Moscow."
+            )
+            return
+
+        try:
+            tz = ZoneInfo(context.args[0]).key
+        except (ZoneInfoNotFoundError, ValueError):
+            await update.message.reply_text(
+                "Не знаю такого часового пояса. Используй название вроде Europe/Moscow или Asia/Yekaterinburg."
+            )
+            return
+
+        await db.update_user_timezone(user.id, tz)
+        await update.message.reply_text(
+            f"Часовой пояс обновлён на {tz}. Цитаты будут приходить в {existing_user[2]} по этому времени."
+        )
+
+
+@instrumented
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
-    existing_user = db.get_user(user.id)
+    existing_user = await db.get_user(user.id)
     if existing_user:
         await update.message.reply_text(
             "Ввод отменен.",
@@ -133,15 +178,16 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
 
+@instrumented
 async def quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
-    existing_user = db.get_user(user.id)
+    existing_user = await db.get_user(user.id)
     if existing_user:
-        quote_data = db.get_random_quote(user.id)
-        if quote_data:
+        quote_text = await db.get_random_quote(user.id)
+        if quote_text:
             await update.message.reply_text(
-                f'*"{quote_data[0]}"* — _{quote_data[1]}_',
+                quote_text,
                 parse_mode="MarkdownV2",
                 reply_markup=ReplyKeyboardMarkup(
                     [["Установить время", "Случайная цитата"], ["Предложить цитату"]],
@@ -153,10 +199,11 @@ async def quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Цитаты отсутствуют.")
 
 
+@instrumented
 async def propose_quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
-    existing_user = db.get_user(user.id)
+    existing_user = await db.get_user(user.id)
     if existing_user:
         await update.message.reply_text(
             "Пожалуйста, введи цитату в формате: <цитата> - <автор> (дефис обязателен)",
@@ -169,10 +216,11 @@ async def propose_quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return AWAIT_QUOTE
 
 
+@instrumented
 async def receive_quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
-    existing_user = db.get_user(user.id)
+    existing_user = await db.get_user(user.id)
     if existing_user:
         text = update.message.text.strip()
 
@@ -192,30 +240,37 @@ async def receive_quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 return AWAIT_QUOTE
 
-            quote_id = db.add_pending_quote(user.id, quote, author)
-
-            escaped_quote, escaped_author = escape_markdown((quote, author))
+            if db.find_similar_quote(quote) is not None:
+                await update.message.reply_text(
+                    "Такая или очень похожая цитата уже есть или ждёт рассмотрения.",
+                    reply_markup=ReplyKeyboardMarkup(
+                        [
+                            ["Установить время", "Случайная цитата"],
+                            ["Предложить цитату"],
+                        ],
+                        one_time_keyboard=True,
+                        resize_keyboard=True,
+                    ),
+                )
+                return ConversationHandler.END
 
-            admin_chat_id = ADMIN_IDS[0]
-            await context.bot.send_message(
-                chat_id=admin_chat_id,
-                text=f'{user.username} предлагает цитату: *"{escaped_quote}"* — _{escaped_author}_',
-                parse_mode="MarkdownV2",
-                reply_markup=InlineKeyboardMarkup(
-                    [
+            if not await proposal_limiter.allow(user.id):
+                minutes = math.ceil(await proposal_limiter.retry_after(user.id) / 60)
+                await update.message.reply_text(
+                    f"Слишком много предложений. Попробуй снова через {minutes} мин.",
+                    reply_markup=ReplyKeyboardMarkup(
                         [
-                            InlineKeyboardButton(
-                                "Принять",
-                                callback_data=f"accept_{user.id}_{quote_id}",
-                            ),
-                            InlineKeyboardButton(
-                                "Отклонить",
-                                callback_data=f"reject_{user.id}_{quote_id}",
-                            ),
-                        ]
-                    ]
-                ),
-            )
+                            ["Установить время", "Случайная цитата"],
+                            ["Предложить цитату"],
+                        ],
+                        one_time_keyboard=True,
+                        resize_keyboard=True,
+                    ),
+                )
+                return ConversationHandler.END
+
+            if await db.add_pending_quote(user.id, quote, author):
+                queue_admin_digest(context.application)
 
             await update.message.reply_text(
                 "Цитата отправлена на рассмотрение.",
@@ -234,15 +289,17 @@ async def receive_quote(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
 
+@instrumented
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
-    existing_user = db.get_user(user.id)
+    existing_user = await db.get_user(user.id)
     if existing_user:
         if not await check_admin(update):
             help_text = (
                 "Доступные команды:\n"
                 "/settime - Установить время для получения цитат\n"
+                "/timezone <пояс> - Установить часовой пояс (например, Europe/Moscow)\n"
                 "/quote - Получить случайную цитату\n"
                 "/propose - Предложить свою цитату\n"
                 "/help - Показать это сообщение"
@@ -251,14 +308,20 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             help_text = (
                 "Доступные команды:\n"
                 "/settime - Установить время для получения цитат\n"
+                "/timezone <пояс> - Установить часовой пояс (например, Europe/Moscow)\n"
                 "/quote - Получить случайную цитату\n"
                 "/propose - Предложить свою цитату\n"
                 "/help - Показать это сообщение\n"
                 "/addquote <цитата> <автор> - Добавить новую цитату (админ)\n"
-                "/listquotes - Просмотреть все цитаты (админ)\n"
+                "/importquotes - Импорт цитат из файла .txt/.csv/.jsonl (админ)\n"
+                "/listquotes [автор] - Просмотреть цитаты по страницам (админ)\n"
+                "/pending - Очередь предложенных цитат (админ)\n"
+                "/deadletters - Недоставленные цитаты (админ)\n"
                 "/deletequote <номер цитаты> - Удалить цитату (админ)\n"
-                "/disable - Отключить бота (админ)\n"
-                "/enable - Включить бота (админ)"
+                "/disable - Остановить рассылку всем (админ)\n"
+                "/enable - Возобновить рассылку (админ)\n"
+                "/pause <ЧЧ:ММ | id-id> - Приостановить рассылку части пользователей (админ)\n"
+                "/resume <ЧЧ:ММ | id-id> - Возобновить рассылку части пользователей (админ)"
             )
 
         await update.message.reply_text(
@@ -0,0 +1,34 @@
+import argparse
+import logging
+import sys
+from log_config import setup_logging
+from database import Database, db_name
+from quote_files import iter_quotes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Импорт цитат из .txt, .csv или .jsonl в базу бота"
+    )
+    parser.add_argument("path")
+    parser.add_argument("--db", default=db_name)
+    parser.add_argument(
+        "--no-dedup", action="store_true", help="не пропускать похожие цитаты"
+    )
+    args = parser.parse_args()
+
+    setup_logging()
+    db = Database(args.db)
+    result = db.import_quotes(iter_quotes(args.path), dedup=not args.no_dedup)
+    report = (
+        f"добавлено {result['added']}, пропущено похожих {result['skipped']}, "
+        f"некорректных строк {result['invalid']}"
+    )
+    if result["error"] is not None:
+        logging.error(f"Импорт прерван: {result['error']}. До ошибки {report}.")
+        sys.exit(1)
+    logging.info(f"Импорт завершён: {report}.")
+
+
+if __name__ == "__main__":
+    main()
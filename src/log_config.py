@@ -1,12 +1,123 @@
+import atexit
+import json
 import logging
+import queue
+import threading
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+from config import (
+    LOG_FILE,
+    LOG_FORMAT,
+    LOG_MAX_BYTES,
+    LOG_ROTATE_WHEN,
+    LOG_BACKUPS,
+    LOG_SAMPLE_RATE,
+)
 
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+RECORD_FIELDS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
 
-def setup_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        handlers=[logging.FileHandler("bot.log"), logging.StreamHandler()],
+listener = None
+
+
+class SamplingFilter(logging.Filter):
+    # Записи с extra={"sample": ключ} пропускаются не чаще rate в секунду на ключ;
+    # первая запись следующей секунды сообщает, сколько было отброшено.
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None:
+            return True
+        second = int(record.created)
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or window[0] != second:
+                suppressed = window[2] if window else 0
+                window = self.windows[key] = [second, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if window[1] >= self.rate:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class LoopQueueHandler(QueueHandler):
+    # Обычный QueueHandler форматирует сообщение ещё в вызывающем потоке;
+    # очередь здесь внутри процесса, поэтому запись уходит как есть, а
+    # форматирование и запись в файл происходят в потоке QueueListener.
+    def prepare(self, record):
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (и ещё {suppressed} таких же пропущено)"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_FIELDS:
+                data[key] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def file_handler(filename):
+    if LOG_ROTATE_WHEN:
+        return TimedRotatingFileHandler(
+            filename, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS, encoding="utf-8"
+        )
+    return RotatingFileHandler(
+        filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
     )
+
+
+def setup_logging(filename=LOG_FILE):
+    global listener
+    stop_logging()
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else TextFormatter(TEXT_FORMAT)
+    handlers = [file_handler(filename), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LoopQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler], force=True)
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(stop_logging)
+
     logging.getLogger("apscheduler").setLevel(logging.WARNING)
     logging.getLogger("telegram").setLevel(logging.WARNING)
     logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def stop_logging():
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
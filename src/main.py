@@ -12,16 +12,25 @@ from telegram.ext import (
 )
 from admin import (
     add_quote,
+    import_quotes,
     list_quotes,
+    list_quotes_page,
     delete_quote,
     handle_quote_decision,
+    list_pending,
+    pending_action,
+    list_dead_letters,
+    dead_letters_action,
     disable_bot,
     enable_bot,
+    pause_segment,
+    resume_segment,
 )
 from handlers import (
     start,
     reset,
     set_time,
+    set_timezone,
     quote,
     help_command,
     button_handler,
@@ -32,21 +41,55 @@ from handlers import (
     AWAIT_TIME,
     AWAIT_QUOTE,
 )
-from scheduler import start_scheduler
-from config import TOKEN
+from persistence import SQLitePersistence
+from updates import PerUserUpdateProcessor
+from scheduler import start_scheduler, stop_scheduler
+from config import (
+    TOKEN,
+    BOT_API_URL,
+    UPDATES_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    CONCURRENT_UPDATES,
+    CONVERSATION_TIMEOUT,
+)
 
 
 def main():
-    app = ApplicationBuilder().token(TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(BOT_API_URL)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .persistence(SQLitePersistence())
+        .post_init(start_scheduler)
+        .post_shutdown(stop_scheduler)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("reset", reset))
     app.add_handler(CommandHandler("quote", quote))
+    app.add_handler(CommandHandler("timezone", set_timezone))
     app.add_handler(CommandHandler("addquote", add_quote))
+    app.add_handler(CommandHandler("importquotes", import_quotes))
+    app.add_handler(
+        MessageHandler(
+            filters.Document.ALL & filters.CaptionRegex(r"^/importquotes"),
+            import_quotes,
+        )
+    )
     app.add_handler(CommandHandler("listquotes", list_quotes))
     app.add_handler(CommandHandler("deletequote", delete_quote))
+    app.add_handler(CommandHandler("pending", list_pending))
+    app.add_handler(CommandHandler("deadletters", list_dead_letters))
     app.add_handler(CommandHandler("disable", disable_bot))
     app.add_handler(CommandHandler("enable", enable_bot))
+    app.add_handler(CommandHandler("pause", pause_segment))
+    app.add_handler(CommandHandler("resume", resume_segment))
     app.add_handler(CommandHandler("help", help_command))
 
     time_conv_handler = ConversationHandler(
@@ -60,6 +103,9 @@ def main():
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        name="settime",
+        persistent=True,
     )
     app.add_handler(time_conv_handler)
 
@@ -74,17 +120,33 @@ def main():
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        name="propose",
+        persistent=True,
     )
     app.add_handler(propose_conv_handler)
 
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, button_handler))
 
-    app.add_handler(CallbackQueryHandler(handle_quote_decision))
-
-    start_scheduler()
+    app.add_handler(CallbackQueryHandler(list_quotes_page, pattern=r"^list_"))
+    app.add_handler(CallbackQueryHandler(pending_action, pattern=r"^pending_"))
+    app.add_handler(CallbackQueryHandler(dead_letters_action, pattern=r"^dead_"))
+    app.add_handler(
+        CallbackQueryHandler(handle_quote_decision, pattern=r"^(accept|reject)_")
+    )
 
-    logging.info("Бот запущен.")
-    app.run_polling()
+    if UPDATES_MODE == "webhook":
+        logging.info(f"Бот запущен, принимаю обновления на порту {WEBHOOK_PORT}.")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        logging.info("Бот запущен.")
+        app.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,237 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+registry = []
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.callback = callback
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def samples(self):
+        if self.callback is None:
+            with self.lock:
+                return list(self.values.items())
+        values = self.callback()
+        if isinstance(values, dict):
+            return list(values.items())
+        return [((), values)]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.samples()):
+            lines.append(
+                f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def add(self, amount, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            series = sorted(
+                (labels, (list(counts), total))
+                for labels, (counts, total) in self.values.items()
+            )
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = format_labels(
+                    self.labels, labels, [("le", format_value(float(bound)))]
+                )
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            label_text = format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{label_text} {total!r}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Время обработки команды", ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках команд", ["handler"]
+)
+DB_SECONDS = Histogram(
+    "bot_db_seconds", "Время выполнения метода Database в потоке", ["method"]
+)
+DB_ERRORS = Counter("bot_db_errors_total", "Исключения в методах Database", ["method"])
+DB_INFLIGHT = Gauge(
+    "bot_db_inflight",
+    "Вызовы Database в очереди пула потоков и в работе",
+    ["pool"],
+)
+TICK_SECONDS = Histogram("bot_delivery_tick_seconds", "Время одного тика рассылки")
+SLOT_SECONDS = Histogram("bot_delivery_slot_seconds", "Время рассылки одного слота")
+MESSAGES_SENT = Counter("bot_messages_sent_total", "Отправленные цитаты")
+MESSAGES_FAILED = Counter("bot_messages_failed_total", "Неотправленные цитаты")
+
+
+def observe(histogram, errors, label, func, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        errors.inc(label)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - started, label)
+
+
+def instrument(histogram, errors, label=None):
+    def decorator(func):
+        name = label or func.__name__
+        if not inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            def call(*args, **kwargs):
+                return observe(histogram, errors, name, func, *args, **kwargs)
+
+            return call
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc(name)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, name)
+
+        return wrapper
+
+    return decorator
+
+
+def instrumented(func):
+    # @instrumented над обработчиком - и у него есть время и ошибки в /metrics.
+    return instrument(HANDLER_SECONDS, HANDLER_ERRORS)(func)
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def handle_request(reader, writer):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)).strip():
+            pass
+        parts = request.split()
+        if len(parts) > 1 and parts[1].split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", render().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        headers = (
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(headers.encode("ascii") + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host, port):
+    try:
+        server = await asyncio.start_server(handle_request, host, port)
+    except OSError as e:
+        logging.error(f"Не удалось открыть /metrics на {host}:{port}: {e}")
+        return None
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
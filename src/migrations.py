@@ -0,0 +1,237 @@
+import logging
+from dedup import quote_hash
+
+
+def add_column(cursor, table, column, definition):
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+    if column in columns:
+        return False
+    logging.info(f"Добавляю в таблицу {table} колонку {column}...")
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+
+def create_tables(cursor):
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        time TEXT,
+        active INTEGER DEFAULT 1
+    )"""
+    )
+
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS quotes (
+        id INTEGER PRIMARY KEY,
+        quote TEXT,
+        author TEXT
+    )"""
+    )
+
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS pending_quotes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        quote TEXT NOT NULL,
+        author TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending'
+    )"""
+    )
+
+
+def add_user_minute(cursor):
+    if add_column(cursor, "users", "minute", "INTEGER"):
+        users = cursor.execute("SELECT id, time FROM users").fetchall()
+        minutes = []
+        for user_id, time in users:
+            if time:
+                hours, minutes_part = map(int, time.split(":"))
+                minutes.append((hours * 60 + minutes_part, user_id))
+        cursor.executemany("UPDATE users SET minute = ? WHERE id = ?", minutes)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_minute ON users (minute, active)"
+    )
+
+
+def add_user_rotation(cursor):
+    add_column(cursor, "users", "rotation_seed", "INTEGER")
+    add_column(cursor, "users", "rotation_pos", "INTEGER")
+    add_column(cursor, "users", "rotation_size", "INTEGER")
+
+
+def add_quote_hashes(cursor):
+    for table in ("quotes", "pending_quotes"):
+        add_column(cursor, table, "quote_hash", "INTEGER")
+        rows = cursor.execute(f"SELECT id, quote FROM {table}").fetchall()
+        cursor.executemany(
+            f"UPDATE {table} SET quote_hash = ? WHERE id = ?",
+            [(quote_hash(quote), row_id) for row_id, quote in rows],
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_hash ON {table} (quote_hash)"
+        )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_pending_quotes_status "
+        "ON pending_quotes (status, id)"
+    )
+
+
+def add_user_timezone(cursor):
+    add_column(cursor, "users", "tz", "TEXT")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_slot ON users (minute, tz, active)"
+    )
+    cursor.execute("DROP INDEX IF EXISTS idx_users_minute")
+
+
+def add_delivery_state(cursor):
+    add_column(cursor, "users", "last_sent", "TEXT")
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )"""
+    )
+
+
+def add_delivery_leases(cursor):
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS delivery_leases (
+        shard INTEGER PRIMARY KEY,
+        shards INTEGER NOT NULL,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )"""
+    )
+
+
+def add_persistence_tables(cursor):
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS conversations (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        state TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (name, key)
+    )"""
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_conversations_updated "
+        "ON conversations (updated_at)"
+    )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS user_data (
+        user_id INTEGER PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )"""
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_data_updated ON user_data (updated_at)"
+    )
+
+
+def add_moderation(cursor):
+    add_column(cursor, "pending_quotes", "decided_at", "REAL")
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS pending_quotes_archive (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        quote TEXT NOT NULL,
+        author TEXT NOT NULL,
+        status TEXT NOT NULL,
+        quote_hash INTEGER,
+        decided_at REAL
+    )"""
+    )
+    # Раньше принятые цитаты оставались в очереди со статусом pending.
+    cursor.execute(
+        "UPDATE pending_quotes SET status = 'accepted', decided_at = 0 "
+        "WHERE status = 'pending' AND EXISTS (SELECT 1 FROM quotes "
+        "WHERE quotes.quote_hash = pending_quotes.quote_hash "
+        "AND quotes.quote = pending_quotes.quote)"
+    )
+
+
+def add_proposal_limits(cursor):
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS proposal_limits (
+        user_id INTEGER PRIMARY KEY,
+        tokens REAL,
+        updated_at REAL
+    )"""
+    )
+
+
+def add_user_pause(cursor):
+    add_column(cursor, "users", "paused", "INTEGER NOT NULL DEFAULT 0")
+    # Раньше /disable выключал всех пользователей разом; теперь для этого есть
+    # общий флаг рассылки, а active остаётся у каждого своим.
+    disabled = cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM users) "
+        "AND NOT EXISTS (SELECT 1 FROM users WHERE active = 1)"
+    ).fetchone()[0]
+    if disabled:
+        cursor.execute("UPDATE users SET active = 1")
+        cursor.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES ('delivery_enabled', 0)"
+        )
+
+
+def add_delivery_outbox(cursor):
+    # Одна строка на пользователя и день: (user_id, day) не даёт поставить в
+    # очередь вторую цитату за день, даже если слот разослан повторно.
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS delivery_outbox (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        text TEXT NOT NULL,
+        fire_at REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        last_error TEXT,
+        updated_at REAL,
+        UNIQUE (user_id, day)
+    )"""
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_delivery_outbox_due "
+        "ON delivery_outbox (status, next_attempt_at)"
+    )
+
+
+MIGRATIONS = [
+    create_tables,
+    add_user_minute,
+    add_user_rotation,
+    add_quote_hashes,
+    add_user_timezone,
+    add_delivery_state,
+    add_delivery_leases,
+    add_persistence_tables,
+    add_moderation,
+    add_proposal_limits,
+    add_user_pause,
+    add_delivery_outbox,
+]
+
+
+def migrate(conn):
+    cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        logging.info(f"Применяю миграцию {number}: {migration.__name__}...")
+        cursor.execute("BEGIN")
+        try:
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    return max(version, len(MIGRATIONS))
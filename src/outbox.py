@@ -0,0 +1,46 @@
+from telegram.error import BadRequest, Forbidden
+from config import OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX
+
+
+def retry_delay(attempts):
+    return min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+
+
+def chat_gone(error):
+    # Бот заблокирован, аккаунт удалён или чата больше нет - писать сюда бесполезно.
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and "chat not found" in error.message.lower()
+
+
+def split_batch(rows):
+    # В одной пачке не больше одной цитаты на пользователя: результаты рассылки
+    # приходят по chat_id. Остальные вернутся в очередь и уйдут следующей пачкой.
+    batch, released = {}, []
+    for row in rows:
+        if row[1] in batch:
+            released.append(row[0])
+        else:
+            batch[row[1]] = row
+    return batch, released
+
+
+def sort_results(batch, results, now):
+    outcome = {"sent": [], "retry": [], "dead": [], "gone": [], "released": []}
+    for chat_id, error in results:
+        delivery_id, user_id, _, attempts, _ = batch.pop(chat_id)
+        attempts += 1
+        if error is None:
+            outcome["sent"].append(delivery_id)
+        elif chat_gone(error):
+            outcome["dead"].append((str(error), delivery_id))
+            outcome["gone"].append(user_id)
+        elif isinstance(error, BadRequest) or attempts >= OUTBOX_MAX_ATTEMPTS:
+            outcome["dead"].append((str(error), delivery_id))
+        else:
+            outcome["retry"].append(
+                (now + retry_delay(attempts), str(error), delivery_id)
+            )
+    # Не отправленные из-за остановки рассылки - обратно в очередь без попытки.
+    outcome["released"].extend(row[0] for row in batch.values())
+    return outcome
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from telegram.ext import BasePersistence, PersistenceInput
+from async_db import AsyncDatabase
+from config import PERSISTENCE_INTERVAL, CONVERSATION_TIMEOUT, USER_DATA_MEMORY_MAX
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.db = AsyncDatabase()
+        self.pending_conversations = {}
+        self.pending_user_data = {}
+        self.write_task = None
+        self.last_seen = OrderedDict()
+        self.evicted = set()
+        self.evicting = set()
+
+    async def write(self):
+        # Все update_* одного прохода update_persistence попадают в одну транзакцию.
+        if self.write_task is None:
+            self.write_task = asyncio.ensure_future(self.write_pending())
+        await self.write_task
+
+    async def write_pending(self):
+        self.write_task = None
+        conversations, self.pending_conversations = self.pending_conversations, {}
+        user_data, self.pending_user_data = self.pending_user_data, {}
+        if conversations or user_data:
+            await self.db.save_persistence(conversations, user_data)
+
+    async def get_conversations(self, name):
+        rows = await self.db.get_conversations(name, time.time() - CONVERSATION_TIMEOUT)
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        state = None if new_state is None else json.dumps(new_state)
+        self.pending_conversations[(name, json.dumps(key))] = state
+        await self.write()
+
+    async def get_user_data(self):
+        rows = await self.db.get_user_data(USER_DATA_MEMORY_MAX)
+        self.evicted.update(await self.db.get_user_data_ids(USER_DATA_MEMORY_MAX))
+        now = time.monotonic()
+        for user_id, _ in reversed(rows):
+            self.last_seen[user_id] = now
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def update_user_data(self, user_id, data):
+        self.pending_user_data[user_id] = json.dumps(data) if data else None
+        await self.write()
+
+    async def refresh_user_data(self, user_id, user_data):
+        self.last_seen[user_id] = time.monotonic()
+        self.last_seen.move_to_end(user_id)
+        if user_id not in self.evicted:
+            return
+        self.evicted.discard(user_id)
+        if user_id in self.pending_user_data:
+            data = self.pending_user_data[user_id]
+        else:
+            data = await self.db.load_user_data(user_id)
+        if data and not user_data:
+            user_data.update(json.loads(data))
+
+    async def drop_user_data(self, user_id):
+        if user_id in self.evicting:
+            self.evicting.discard(user_id)
+            return
+        self.evicted.discard(user_id)
+        self.last_seen.pop(user_id, None)
+        self.pending_user_data[user_id] = None
+        await self.write()
+
+    def evict(self, application):
+        # Давно не писавших пользователей убираем из памяти, их user_data остаётся
+        # в базе и подгружается обратно в refresh_user_data.
+        cutoff = time.monotonic() - 2 * self.update_interval
+        evicted = 0
+        while self.last_seen and len(application.user_data) > USER_DATA_MEMORY_MAX:
+            user_id, seen = next(iter(self.last_seen.items()))
+            if seen > cutoff:
+                break
+            del self.last_seen[user_id]
+            if application.user_data.get(user_id):
+                self.evicted.add(user_id)
+            self.evicting.add(user_id)
+            application.drop_user_data(user_id)
+            evicted += 1
+        return evicted
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self.write_task is not None:
+            await self.write_task
+        await self.write_pending()
@@ -0,0 +1,85 @@
+import csv
+import json
+import logging
+import os
+
+QUOTE_FILE_FORMATS = (".txt", ".csv", ".jsonl")
+
+
+def parse_quote_line(line):
+    if " - " not in line:
+        return None
+    quote, author = line.rsplit(" - ", 1)
+    quote = quote.strip().strip('"')
+    author = author.strip()
+    if not quote or not author:
+        return None
+    return quote, author
+
+
+def bad_line(number, reason):
+    # Битая строка не прерывает импорт: читатель отдаёт None, а импорт считает
+    # такие строки и сообщает, сколько их было.
+    logging.warning(f"Строка {number} пропущена: {reason}")
+    return None
+
+
+def iter_txt(file):
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        parsed = parse_quote_line(line)
+        yield parsed or bad_line(number, "нужно <цитата> - <автор>")
+
+
+def iter_csv(file):
+    reader = csv.reader(file)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield bad_line(reader.line_num, e)
+            continue
+        if not row:
+            continue
+        if reader.line_num == 1 and [c.strip().lower() for c in row[:2]] == [
+            "quote",
+            "author",
+        ]:
+            continue
+        quote = row[0].strip().strip('"')
+        author = row[1].strip() if len(row) > 1 else ""
+        if quote and author:
+            yield quote, author
+        else:
+            yield bad_line(reader.line_num, "нужны колонки quote,author")
+
+
+def iter_jsonl(file):
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            yield bad_line(number, e)
+            continue
+        if not isinstance(item, dict):
+            yield bad_line(number, "нужен объект с полями quote и author")
+            continue
+        quote = str(item.get("quote", "")).strip().strip('"')
+        author = str(item.get("author", "")).strip()
+        if quote and author:
+            yield quote, author
+        else:
+            yield bad_line(number, "нужны поля quote и author")
+
+
+def iter_quotes(path):
+    extension = os.path.splitext(path)[1].lower()
+    readers = {".csv": iter_csv, ".jsonl": iter_jsonl}
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        yield from readers.get(extension, iter_txt)(file)
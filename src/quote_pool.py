@@ -0,0 +1,44 @@
+import bisect
+from rendering import render_quote
+
+
+class QuotePool:
+    def __init__(self):
+        # ids отсортированы: номер цитаты в списке - её место в ротации.
+        self.ids = []
+        self.quotes = {}
+        self.rendered_quotes = {}
+        self.max_id = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self, rows):
+        self.ids = []
+        self.quotes = {}
+        self.rendered_quotes = {}
+        self.max_id = 0
+        for quote_id, quote, author in sorted(rows):
+            self.add(quote_id, quote, author)
+
+    def add(self, quote_id, quote, author):
+        if quote_id not in self.quotes:
+            if quote_id > self.max_id:
+                self.ids.append(quote_id)
+                self.max_id = quote_id
+            else:
+                bisect.insort(self.ids, quote_id)
+        self.quotes[quote_id] = (quote, author)
+        self.rendered_quotes[quote_id] = render_quote(quote, author)
+
+    def remove(self, quote_id):
+        if self.quotes.pop(quote_id, None) is None:
+            return
+        del self.rendered_quotes[quote_id]
+        del self.ids[bisect.bisect_left(self.ids, quote_id)]
+
+    def get(self, quote_id):
+        return self.quotes.get(quote_id)
+
+    def rendered(self, quote_id):
+        return self.rendered_quotes.get(quote_id)
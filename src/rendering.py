@@ -0,0 +1,13 @@
+# Обратный слеш экранируется первым, чтобы не задеть добавленные ниже слеши.
+MARKDOWN_SPECIAL_CHARACTERS = "\\_*[]()~`>#+-=|{}.!"
+
+
+def escape(text):
+    for char in MARKDOWN_SPECIAL_CHARACTERS:
+        if char in text:
+            text = text.replace(char, f"\\{char}")
+    return text
+
+
+def render_quote(quote, author):
+    return f'*"{escape(quote)}"* — _{escape(author)}_'
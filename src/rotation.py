@@ -0,0 +1,54 @@
+import random
+
+MASK64 = (1 << 64) - 1
+
+
+def _mix(value, seed, round_number):
+    x = (value + seed * 0x9E3779B97F4A7C15 + round_number * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+def permute(index, size, seed):
+    # Сеть Фейстеля на ближайшей степени двойки + cycle walking даёт
+    # перестановку [0, size) без хранения самой перестановки.
+    half = max(1, ((size - 1).bit_length() + 1) // 2)
+    mask = (1 << half) - 1
+    while True:
+        left, right = index >> half, index & mask
+        for round_number in range(4):
+            left, right = right, left ^ (_mix(right, seed, round_number) & mask)
+        index = (left << half) | right
+        if index < size:
+            return index
+
+
+def next_quote(pool, seed, position, size):
+    # Перестановка идёт по номерам в pool.ids, а не по самим id: дыры после
+    # удалённых цитат не стоят ни одного шага. Цитаты, добавленные после начала
+    # круга, идут в его конце по порядку - следующего круга они не ждут.
+    count = len(pool)
+    if not count:
+        return None, seed, position, size
+    for _ in range(2):
+        if (
+            seed is None
+            or position is None
+            or not size
+            or size > 2 * count
+            or position >= max(size, count)
+        ):
+            seed = random.getrandbits(32)
+            position = 0
+            size = count
+        while position < size:
+            index = permute(position, size, seed)
+            position += 1
+            if index < count:
+                return pool.ids[index], seed, position, size
+        if position < count:
+            position += 1
+            return pool.ids[position - 1], seed, position, size
+        seed = None
+    return None, seed, position, size
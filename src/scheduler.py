@@ -1,33 +1,494 @@
+import asyncio
 import logging
+import os
+import socket
+import time
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from telegram import Bot
-from datetime import datetime
-from database import Database
-from config import TOKEN
-
-db = Database()
-
-
-async def send_quotes():
-    users = db.get_all_users()
-    for user in users:
-        user_id, username, user_time = user
-        current_time = datetime.now().strftime("%H:%M")
-        if current_time == user_time:
-            logging.info(
-                f"Настало время ({user_time}) отправить цитату пользователю @{username}({user_id})"
-            )
-            quote_data = db.get_random_quote(user_id)
-            if quote_data:
-                bot = Bot(TOKEN)
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=f'*"{quote_data[0]}"* — _{quote_data[1]}_',
-                    parse_mode="MarkdownV2",
-                )
-
-
-def start_scheduler():
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(send_quotes, "interval", minutes=1)
-    scheduler.start()
+from datetime import datetime, timedelta, timezone
+from admin import send_admin_digest
+from broadcast import Broadcaster, create_bot
+from async_db import AsyncDatabase
+from database import minute_to_time
+from metrics import (
+    Counter,
+    Gauge,
+    TICK_SECONDS,
+    SLOT_SECONDS,
+    MESSAGES_SENT,
+    MESSAGES_FAILED,
+    start_server,
+)
+from outbox import split_batch, sort_results
+from throttle import proposal_limiter
+from timeline import DeliveryTimeline, get_zone, next_fire
+from config import (
+    USER_FLUSH_INTERVAL_MS,
+    DELIVERY_CATCH_UP,
+    DELIVERY_SHARDS,
+    CONVERSATION_TIMEOUT,
+    ADMIN_DIGEST_INTERVAL,
+    METRICS_LISTEN,
+    METRICS_PORT,
+)
+
+MAX_SLEEP = 60
+LEASE_TTL = 30
+PENDING_ARCHIVE_AFTER = 24 * 60 * 60
+OUTBOX_BATCH = 200
+OUTBOX_LEASE = 5 * 60
+OUTBOX_POLL = 5
+OUTBOX_SENT_KEEP = 2 * 24 * 60 * 60
+OUTBOX_DEAD_KEEP = 30 * 24 * 60 * 60
+DRAIN_TIMEOUT = 30
+QUOTES_RELOAD_INTERVAL = 60
+
+db = AsyncDatabase()
+broadcaster = Broadcaster(create_bot())
+timeline = DeliveryTimeline()
+wakeup = asyncio.Event()
+outbox_ready = asyncio.Event()
+stopping = False
+delivery_task = None
+index_task = None
+metrics_server = None
+jobs = None
+delivery_tasks = {}
+# Итоги слотов по времени срабатывания: пачки из очереди отправки не совпадают
+# со слотами, поэтому результаты копятся здесь и попадают в лог один раз.
+slot_progress = {}
+delivery_stats = {
+    "ticks": 0,
+    "slots_sent": 0,
+    "slots_caught_up": 0,
+    "slots_skipped": 0,
+    "slots_paused": 0,
+    "messages_queued": 0,
+    "messages_retried": 0,
+    "messages_dead": 0,
+    "messages_expired": 0,
+    "users_deactivated": 0,
+    "last_lag": 0.0,
+    "max_lag": 0.0,
+}
+
+DELIVERY_STATS_HELP = {
+    "ticks": "Тиков рассылки, на которых наступили слоты",
+    "slots_sent": "Разосланных слотов",
+    "slots_caught_up": "Слотов, досланных после простоя",
+    "slots_skipped": "Слотов, пропущенных из-за опоздания больше DELIVERY_CATCH_UP",
+    "slots_paused": "Слотов, пропущенных при выключенной рассылке",
+    "messages_queued": "Цитат, поставленных в очередь отправки",
+    "messages_retried": "Временных ошибок отправки, отложенных на повтор",
+    "messages_dead": "Цитат, которые не удалось доставить",
+    "messages_expired": "Цитат, не доставленных за DELIVERY_CATCH_UP",
+    "users_deactivated": "Пользователей, отключённых после блокировки бота",
+    "last_lag": "Опоздание последнего тика",
+    "max_lag": "Наибольшее опоздание тика",
+}
+for key, help in DELIVERY_STATS_HELP.items():
+    if key.endswith("_lag"):
+        metric, name = Gauge, f"bot_delivery_{key}_seconds"
+    else:
+        metric, name = Counter, f"bot_delivery_{key}_total"
+    metric(name, help, callback=lambda key=key: delivery_stats[key])
+Gauge(
+    "bot_delivery_slots",
+    "Слотов в очереди рассылки",
+    callback=lambda: len(timeline),
+)
+Gauge(
+    "bot_delivery_slots_running",
+    "Слотов, рассылка которых идёт сейчас",
+    callback=lambda: len(delivery_tasks),
+)
+outbox_depth = {"pending": 0, "dead": 0}
+Gauge(
+    "bot_outbox_messages",
+    "Цитат в очереди отправки по состояниям",
+    ["status"],
+    callback=lambda: {(status,): count for status, count in outbox_depth.items()},
+)
+Gauge(
+    "bot_delivery_last_slot_messages",
+    "Цитаты последнего разосланного слота",
+    ["result"],
+    callback=lambda: {
+        (result,): (broadcaster.last_stats or {}).get(result, 0)
+        for result in ("sent", "failed")
+    },
+)
+Gauge(
+    "bot_delivery_last_slot_lag_seconds",
+    "Задержка окончания последнего слота от его начала",
+    callback=lambda: (broadcaster.last_stats or {}).get("lag", 0.0),
+)
+Gauge(
+    "bot_user_writes_pending",
+    "Изменений пользователей, ещё не записанных в базу",
+    callback=lambda: len(db.user_writes),
+)
+Gauge(
+    "bot_user_cache_size", "Пользователей в кэше", callback=lambda: len(db.user_cache)
+)
+Counter(
+    "bot_user_cache_hits_total", "Попадания в кэш", callback=lambda: db.user_cache.hits
+)
+Counter(
+    "bot_user_cache_misses_total",
+    "Промахи кэша",
+    callback=lambda: db.user_cache.misses,
+)
+
+
+async def flush_user_writes(application=None):
+    await db.flush_users()
+
+
+def log_cache_stats():
+    stats = db.user_cache.stats()
+    logging.info(
+        f"Кэш пользователей: {stats['size']} записей, попаданий {stats['hits']}, "
+        f"промахов {stats['misses']} ({stats['hit_rate']:.0%})"
+    )
+
+
+def log_delivery_stats():
+    stats = delivery_stats
+    logging.info(
+        f"Рассылка: тиков {stats['ticks']}, слотов отправлено {stats['slots_sent']}, "
+        f"дослано {stats['slots_caught_up']}, пропущено {stats['slots_skipped']}, "
+        f"на паузе {stats['slots_paused']}, "
+        f"в очереди отправки {outbox_depth['pending']}, "
+        f"не доставлено {outbox_depth['dead']}, "
+        f"опоздание тика {stats['last_lag']:.3f} с (макс. {stats['max_lag']:.3f} с)"
+    )
+
+
+def evict_user_data(application):
+    evicted = application.persistence.evict(application)
+    if evicted:
+        logging.info(f"Выгрузил из памяти user_data {evicted} пользователей.")
+
+
+async def archive_pending_quotes():
+    await db.archive_pending_quotes(time.time() - PENDING_ARCHIVE_AFTER)
+
+
+async def save_proposal_limits():
+    await proposal_limiter.save()
+
+
+async def reload_quotes():
+    # Подхватывает цитаты, загруженные import_quotes.py в работающую базу.
+    await db.reload_quote_pool()
+
+
+async def prune_outbox():
+    now = time.time()
+    await db.prune_deliveries(now - OUTBOX_SENT_KEEP, now - OUTBOX_DEAD_KEEP)
+
+
+async def expire_conversations():
+    await db.expire_conversations(time.time() - CONVERSATION_TIMEOUT)
+
+
+def add_slot(slot, after=None):
+    if slot not in timeline:
+        timeline.add(slot, after or datetime.now(timezone.utc))
+        wakeup.set()
+
+
+def count_skipped(slot, start, end):
+    skipped = 0
+    fire_at = next_fire(slot, start)
+    while fire_at <= end:
+        skipped += 1
+        fire_at = next_fire(slot, fire_at)
+    return skipped
+
+
+async def send_slot(fire_at, slot):
+    started = time.monotonic()
+    tz, minute = slot
+    day = fire_at.astimezone(get_zone(tz)).date().isoformat()
+    await db.flush_users()
+    users = await db.get_users_for_slot(tz, minute, day)
+    if not users:
+        return
+    logging.info(
+        f"Настало время ({minute_to_time(minute)}, {tz or 'пояс по умолчанию'}) "
+        f"отправить цитаты {len(users)} пользователям"
+    )
+    queued = await db.enqueue_deliveries(users, day, fire_at.timestamp())
+    delivery_stats["messages_queued"] += queued
+    delivery_stats["slots_sent"] += 1
+    if queued:
+        slot_progress.setdefault(fire_at.timestamp(), new_slot_progress(started))
+    outbox_ready.set()
+
+
+def new_slot_progress(started):
+    return {"sent": 0, "failed": 0, "started": started, "finished": None, "lag": 0.0}
+
+
+def count_slot_results(batch, results, started):
+    # Повторы относятся к слоту, итоги которого уже в логе, - они видны только
+    # в общих счётчиках.
+    finished, now = time.monotonic(), time.time()
+    for chat_id, error in results:
+        _, _, _, attempts, fire_at = batch[chat_id]
+        if attempts:
+            continue
+        progress = slot_progress.get(fire_at)
+        if progress is None:
+            progress = slot_progress[fire_at] = new_slot_progress(started)
+        progress["sent" if error is None else "failed"] += 1
+        progress["finished"] = finished
+        progress["lag"] = now - fire_at
+
+
+def report_slots():
+    # Очередь отправки опустела - слоты, из которых что-то отправлено, разосланы.
+    expired = time.time() - DELIVERY_CATCH_UP
+    for fire_at, progress in list(slot_progress.items()):
+        if progress["finished"] is None:
+            if fire_at < expired:
+                del slot_progress[fire_at]
+            continue
+        del slot_progress[fire_at]
+        elapsed = progress["finished"] - progress["started"]
+        broadcaster.report(
+            datetime.fromtimestamp(fire_at, timezone.utc),
+            progress["sent"],
+            progress["failed"],
+            elapsed,
+            progress["lag"],
+        )
+        SLOT_SECONDS.observe(elapsed)
+
+
+async def send_deliveries(rows):
+    batch, released = split_batch(rows)
+    fire_at = datetime.fromtimestamp(
+        min(row[4] for row in batch.values()), timezone.utc
+    )
+    started = time.monotonic()
+    results = await broadcaster.broadcast(
+        fire_at,
+        [(user_id, row[2]) for user_id, row in batch.items()],
+        stop=lambda: stopping or not db.delivery_enabled,
+        report=False,
+        parse_mode="MarkdownV2",
+    )
+    count_slot_results(batch, results, started)
+    outcome = sort_results(batch, results, time.time())
+    outcome["released"].extend(released)
+    await db.finish_deliveries(**outcome)
+    MESSAGES_SENT.inc(amount=len(outcome["sent"]))
+    MESSAGES_FAILED.inc(amount=len(outcome["retry"]) + len(outcome["dead"]))
+    delivery_stats["messages_retried"] += len(outcome["retry"])
+    delivery_stats["messages_dead"] += len(outcome["dead"])
+    delivery_stats["users_deactivated"] += len(outcome["gone"])
+    return len(results)
+
+
+async def drain_due():
+    # Отправляет из очереди всё, чему подошло время; возвращает число попыток.
+    expired = await db.expire_deliveries(time.time() - DELIVERY_CATCH_UP)
+    delivery_stats["messages_expired"] += expired
+    delivery_stats["messages_dead"] += expired
+    attempted = 0
+    while db.delivery_enabled and not stopping:
+        rows = await db.claim_deliveries(OUTBOX_BATCH, OUTBOX_LEASE)
+        if not rows:
+            break
+        attempted += await send_deliveries(rows)
+    report_slots()
+    for status in outbox_depth:
+        outbox_depth[status] = await db.count_deliveries(status)
+    return attempted
+
+
+async def drain_outbox():
+    # Новые цитаты будят очередь сразу, отложенные повторы подбираются опросом.
+    while not stopping:
+        outbox_ready.clear()
+        try:
+            await drain_due()
+        except Exception as e:
+            logging.error(f"Ошибка при отправке из очереди: {e}")
+        try:
+            await asyncio.wait_for(outbox_ready.wait(), OUTBOX_POLL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_slot(fire_at, slot):
+    task = asyncio.create_task(send_slot(fire_at, slot))
+    delivery_tasks[task] = fire_at
+    task.add_done_callback(finish_slot)
+
+
+def finish_slot(task):
+    delivery_tasks.pop(task, None)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Ошибка при рассылке", exc_info=task.exception())
+
+
+async def save_last_tick(shard, now):
+    # Всё, что должно было сработать не позже этого момента, уже отправлено.
+    last_tick = now
+    if delivery_tasks:
+        last_tick = min(delivery_tasks.values()) - timedelta(microseconds=1)
+    await db.set_setting(f"last_tick:{shard}", last_tick.isoformat())
+
+
+async def tick(shard, now):
+    started = time.perf_counter()
+    due = timeline.pop_due(now)
+    if due:
+        delivery_stats["ticks"] += 1
+        lag = (now - due[-1][0]).total_seconds()
+        delivery_stats["last_lag"] = lag
+        delivery_stats["max_lag"] = max(delivery_stats["max_lag"], lag)
+    for fire_at, slot in due:
+        if slot in db.schedule:
+            timeline.add(slot, fire_at)
+        if not db.delivery_enabled:
+            delivery_stats["slots_paused"] += 1
+            continue
+        late = (now - fire_at).total_seconds()
+        if late > DELIVERY_CATCH_UP:
+            delivery_stats["slots_skipped"] += 1
+            continue
+        if late >= MAX_SLEEP:
+            delivery_stats["slots_caught_up"] += 1
+            logging.info(f"Досылаю пропущенную отправку {fire_at:%Y-%m-%d %H:%M} UTC")
+        start_slot(fire_at, slot)
+    await save_last_tick(shard, now)
+    TICK_SECONDS.observe(time.perf_counter() - started)
+
+
+async def deliver(shard):
+    loop = asyncio.get_running_loop()
+    db.slot_listeners.append(lambda slot: loop.call_soon_threadsafe(add_slot, slot))
+    now = datetime.now(timezone.utc)
+    after = now
+    last_tick = await db.get_setting(f"last_tick:{shard}")
+    if last_tick is not None:
+        last_tick = datetime.fromisoformat(last_tick)
+        after = max(last_tick, now - timedelta(seconds=DELIVERY_CATCH_UP))
+        for slot in list(db.schedule):
+            delivery_stats["slots_skipped"] += count_skipped(slot, last_tick, after)
+        logging.info(f"Последняя отправка: {last_tick:%Y-%m-%d %H:%M:%S} UTC")
+    for slot in list(db.schedule):
+        add_slot(slot, after)
+    logging.info(f"Расписание рассылки: {len(timeline)} слотов.")
+    while True:
+        await tick(shard, datetime.now(timezone.utc))
+        delay = MAX_SLEEP
+        next_at = timeline.next_at()
+        if next_at is not None:
+            delay = (next_at - datetime.now(timezone.utc)).total_seconds()
+            delay = min(max(delay, 0), MAX_SLEEP)
+        wakeup.clear()
+        try:
+            await asyncio.wait_for(wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def keep_lease(shard, shards, owner):
+    while True:
+        await asyncio.sleep(LEASE_TTL / 3)
+        if not await db.acquire_lease(shard, shards, owner, LEASE_TTL):
+            logging.error(f"Потерял аренду шарда {shard}/{shards}, прекращаю рассылку")
+            return
+
+
+async def acquire_lease(shard, shards, owner):
+    while not await db.acquire_lease(shard, shards, owner, LEASE_TTL):
+        logging.info(f"Шард {shard}/{shards} занят другим процессом, жду...")
+        await asyncio.sleep(LEASE_TTL / 3)
+    logging.info(f"Получил аренду шарда {shard}/{shards} ({owner})")
+
+
+async def run_delivery(shard=0, shards=1):
+    # Каждый шард рассылает только пользователям с id % shards == shard и держит
+    # аренду в базе, чтобы два процесса не рассылали одним и тем же людям.
+    global stopping
+    stopping = False
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    if shards > 1:
+        await db.set_shard(shard, shards)
+    await acquire_lease(shard, shards, owner)
+    drainer = asyncio.create_task(drain_outbox())
+    tasks = [
+        asyncio.create_task(deliver(shard)),
+        asyncio.create_task(keep_lease(shard, shards, owner)),
+        drainer,
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        # Текущая пачка дописывается, чтобы уже отправленные цитаты были
+        # отмечены и не ушли второй раз после перезапуска.
+        stopping = True
+        outbox_ready.set()
+        for task in tasks:
+            if task is not drainer:
+                task.cancel()
+        await asyncio.wait([drainer], timeout=DRAIN_TIMEOUT)
+        drainer.cancel()
+        await asyncio.gather(*tasks, *delivery_tasks, return_exceptions=True)
+        await db.release_lease(shard, owner)
+
+
+async def start_metrics(port, host=METRICS_LISTEN):
+    global metrics_server
+    if port is not None:
+        metrics_server = await start_server(host, port)
+
+
+async def stop_metrics():
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+
+
+async def start_scheduler(application):
+    global delivery_task, index_task, jobs
+    await start_metrics(METRICS_PORT)
+    jobs = AsyncIOScheduler()
+    jobs.add_job(log_cache_stats, "interval", minutes=10)
+    jobs.add_job(log_delivery_stats, "interval", minutes=10)
+    jobs.add_job(expire_conversations, "interval", minutes=10)
+    jobs.add_job(archive_pending_quotes, "interval", hours=1)
+    jobs.add_job(prune_outbox, "interval", hours=1)
+    jobs.add_job(reload_quotes, "interval", seconds=QUOTES_RELOAD_INTERVAL)
+    jobs.add_job(evict_user_data, "interval", minutes=1, args=[application])
+    jobs.add_job(save_proposal_limits, "interval", minutes=1)
+    jobs.add_job(
+        send_admin_digest,
+        "interval",
+        seconds=ADMIN_DIGEST_INTERVAL,
+        args=[application.bot],
+    )
+    jobs.add_job(flush_user_writes, "interval", seconds=USER_FLUSH_INTERVAL_MS / 1000)
+    jobs.start()
+    index_task = asyncio.create_task(db.build_similarity_index())
+    if not DELIVERY_SHARDS:
+        delivery_task = asyncio.create_task(run_delivery())
+
+
+async def stop_scheduler(application):
+    if jobs is not None:
+        jobs.shutdown(wait=False)
+    if delivery_task is not None:
+        delivery_task.cancel()
+        await asyncio.gather(delivery_task, return_exceptions=True)
+    await flush_user_writes()
+    await save_proposal_limits()
+    await stop_metrics()
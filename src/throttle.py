@@ -0,0 +1,59 @@
+import time
+from async_db import AsyncDatabase
+from broadcast import TokenBucket
+from config import PROPOSAL_LIMIT, PROPOSAL_PERIOD
+
+
+class ProposalLimiter:
+    def __init__(self, limit=PROPOSAL_LIMIT, period=PROPOSAL_PERIOD):
+        self.limit = limit
+        self.rate = limit / period
+        self.buckets = {}
+        self.dirty = set()
+        self.db = AsyncDatabase()
+
+    async def bucket(self, user_id):
+        bucket = self.buckets.get(user_id)
+        if bucket is not None:
+            return bucket
+        row = await self.db.get_proposal_limit(user_id)
+        bucket = self.buckets.get(user_id)
+        if bucket is not None:
+            return bucket
+        bucket = TokenBucket(self.rate, self.limit)
+        if row is not None:
+            # В базе время настенное, в корзине - монотонное.
+            tokens, updated_at = row
+            bucket.tokens = tokens
+            bucket.updated -= max(0, time.time() - updated_at)
+        self.buckets[user_id] = bucket
+        return bucket
+
+    async def allow(self, user_id):
+        bucket = await self.bucket(user_id)
+        if not bucket.try_acquire():
+            return False
+        self.dirty.add(user_id)
+        return True
+
+    async def retry_after(self, user_id):
+        bucket = await self.bucket(user_id)
+        return bucket.wait_time()
+
+    async def save(self):
+        # Полная корзина - состояние по умолчанию, её не держим ни в памяти, ни в базе.
+        now = time.time()
+        limits, full = [], []
+        for user_id, bucket in list(self.buckets.items()):
+            bucket.refill()
+            if bucket.tokens >= self.limit:
+                del self.buckets[user_id]
+                full.append(user_id)
+            elif user_id in self.dirty:
+                limits.append((user_id, bucket.tokens, now))
+        self.dirty.clear()
+        if limits or full:
+            await self.db.save_proposal_limits(limits, full)
+
+
+proposal_limiter = ProposalLimiter()
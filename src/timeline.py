@@ -0,0 +1,69 @@
+import heapq
+import itertools
+from datetime import datetime, time, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from tzlocal import get_localzone
+from config import DEFAULT_TIMEZONE
+
+
+@lru_cache(maxsize=None)
+def get_zone(tz):
+    if tz:
+        return ZoneInfo(tz)
+    if DEFAULT_TIMEZONE:
+        return ZoneInfo(DEFAULT_TIMEZONE)
+    return get_localzone()
+
+
+def next_fire(slot, after):
+    # Ближайший момент в UTC строго после after, когда в поясе tz наступает minute.
+    # Несуществующее при переводе часов вперёд время сдвигается вперёд (fold=0),
+    # повторяющееся при переводе назад срабатывает один раз - в первый.
+    tz, minute = slot
+    zone = get_zone(tz)
+    day = after.astimezone(zone).date()
+    local_time = time(minute // 60, minute % 60)
+    while True:
+        fire_at = datetime.combine(day, local_time, tzinfo=zone)
+        fire_at = fire_at.astimezone(timezone.utc)
+        if fire_at > after:
+            return fire_at
+        day += timedelta(days=1)
+
+
+class DeliveryTimeline:
+    def __init__(self):
+        self.heap = []
+        self.fire_times = {}
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.fire_times)
+
+    def __contains__(self, slot):
+        return slot in self.fire_times
+
+    def add(self, slot, after):
+        fire_at = next_fire(slot, after)
+        self.fire_times[slot] = fire_at
+        heapq.heappush(self.heap, (fire_at, next(self.counter), slot))
+        return fire_at
+
+    def next_at(self):
+        while self.heap:
+            fire_at, _, slot = self.heap[0]
+            if self.fire_times.get(slot) == fire_at:
+                return fire_at
+            heapq.heappop(self.heap)
+        return None
+
+    def pop_due(self, now):
+        due = []
+        while True:
+            fire_at = self.next_at()
+            if fire_at is None or fire_at > now:
+                return due
+            _, _, slot = heapq.heappop(self.heap)
+            del self.fire_times[slot]
+            due.append((fire_at, slot))
@@ -0,0 +1,44 @@
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # Обновления разных пользователей обрабатываются параллельно, одного - строго
+    # по очереди: иначе ответ в диалоге /settime или /propose может прийти в
+    # обработку раньше, чем ConversationHandler запомнит состояние диалога.
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self.locks = {}
+
+    async def process_update(self, update, coroutine):
+        key = None
+        if isinstance(update, Update):
+            user = update.effective_user or update.effective_chat
+            key = user.id if user is not None else None
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        # Очередь пользователя - до общего семафора: ждущие своей очереди
+        # обновления не должны занимать места, нужные другим пользователям.
+        entry = self.locks.get(key)
+        if entry is None:
+            entry = self.locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,83 @@
+from cache import MISSING
+
+KEEP = object()
+
+
+class UserWriteBuffer:
+    def __init__(self):
+        self.ops = {}
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __contains__(self, user_id):
+        return user_id in self.ops
+
+    def get(self, user_id):
+        return self.ops.get(user_id)
+
+    def add(self, user_id, username, time, minute, tz=None):
+        previous = self.ops.get(user_id)
+        op = "replace" if previous and previous[0] == "delete" else "insert"
+        self.ops[user_id] = (op, username, time, minute, tz)
+
+    def update(self, user_id, time=KEEP, minute=KEEP, tz=KEEP):
+        previous = self.ops.get(user_id)
+        if previous is None:
+            previous = ("update", None, KEEP, KEEP, KEEP)
+        elif previous[0] == "delete":
+            return
+        op, username, old_time, old_minute, old_tz = previous
+        self.ops[user_id] = (
+            op,
+            username,
+            old_time if time is KEEP else time,
+            old_minute if minute is KEEP else minute,
+            old_tz if tz is KEEP else tz,
+        )
+
+    def update_time(self, user_id, time, minute):
+        self.update(user_id, time=time, minute=minute)
+
+    def update_timezone(self, user_id, tz):
+        self.update(user_id, tz=tz)
+
+    def overlay(self, user_id, user):
+        pending = self.ops.get(user_id)
+        if pending is None:
+            return user
+        op, username, time, minute, tz = pending
+        if op == "delete":
+            return None
+        if op != "update":
+            return (user_id, username, time, 1, minute, tz)
+        if user is MISSING or user is None:
+            return user
+        return (
+            user[0],
+            user[1],
+            user[2] if time is KEEP else time,
+            user[3],
+            user[4] if minute is KEEP else minute,
+            user[5] if tz is KEEP else tz,
+        )
+
+    def delete(self, user_id):
+        self.ops[user_id] = ("delete", None, None, None, None)
+
+    def grouped(self):
+        groups = {"insert": [], "replace": [], "time": [], "tz": [], "delete": []}
+        for user_id, (op, username, time, minute, tz) in self.ops.items():
+            if op == "delete":
+                groups[op].append((user_id,))
+            elif op == "update":
+                if time is not KEEP:
+                    groups["time"].append((time, minute, user_id))
+                if tz is not KEEP:
+                    groups["tz"].append((tz, user_id))
+            else:
+                groups[op].append((user_id, username, time, minute, tz))
+        return groups
+
+    def clear(self):
+        self.ops = {}
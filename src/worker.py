@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import logging
+import signal
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from datetime import datetime, timezone
+from broadcast import Broadcaster, GLOBAL_RATE, WORKERS, create_bot
+from log_config import setup_logging
+from database import Database, db_name, time_to_minute
+from config import BOT_API_URL
+
+REFRESH_INTERVAL = 30
+
+
+async def refresh(db):
+    # Пользователей и цитаты меняет процесс бота, поэтому слоты и цитаты перечитываем.
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        await db.refresh_slots()
+        await db.reload_quote_pool()
+        await db.load_delivery_enabled()
+
+
+async def run_slot(scheduler, args):
+    owner = f"run-slot:{args.shard}"
+    await scheduler.db.set_shard(args.shard, args.shards)
+    await scheduler.acquire_lease(args.shard, args.shards, owner)
+    try:
+        slot = (args.tz, time_to_minute(args.run_slot))
+        await scheduler.send_slot(datetime.now(timezone.utc), slot)
+        await scheduler.drain_due()
+    finally:
+        await scheduler.db.release_lease(args.shard, owner)
+
+
+async def run(args):
+    # scheduler создаёт AsyncDatabase при импорте, поэтому импортируем его
+    # только после того, как открыли нужную базу.
+    import scheduler
+
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel
+    )
+    rate = args.rate or GLOBAL_RATE / args.shards
+    scheduler.broadcaster = Broadcaster(
+        create_bot(args.workers, args.api_url), workers=args.workers, global_rate=rate
+    )
+    if args.run_slot:
+        await run_slot(scheduler, args)
+        return
+
+    jobs = AsyncIOScheduler()
+    jobs.add_job(scheduler.log_delivery_stats, "interval", minutes=10)
+    jobs.start()
+    await scheduler.start_metrics(args.metrics_port)
+    refresher = asyncio.create_task(refresh(scheduler.db))
+    try:
+        await scheduler.run_delivery(args.shard, args.shards)
+    finally:
+        refresher.cancel()
+        jobs.shutdown(wait=False)
+        await scheduler.stop_metrics()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Процесс рассылки цитат")
+    parser.add_argument("--shard", type=int, default=0)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--db", default=db_name)
+    parser.add_argument("--api-url", default=BOT_API_URL)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="лимит сообщений в секунду для этого процесса (по умолчанию 30/shards)",
+    )
+    parser.add_argument(
+        "--run-slot", metavar="ЧЧ:ММ", help="разослать один слот сейчас и выйти"
+    )
+    parser.add_argument("--tz", help="часовой пояс слота для --run-slot")
+    parser.add_argument(
+        "--metrics-port", type=int, help="порт для /metrics (по умолчанию выключено)"
+    )
+    args = parser.parse_args()
+    if not 0 <= args.shard < args.shards:
+        parser.error("--shard должен быть от 0 до --shards - 1")
+
+    setup_logging()
+    Database(args.db)
+    logging.info(f"Запускаю рассылку, шард {args.shard}/{args.shards}.")
+    try:
+        asyncio.run(run(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logging.info(f"Рассылка шарда {args.shard}/{args.shards} остановлена.")
+
+
+if __name__ == "__main__":
+    main()